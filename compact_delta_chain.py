@@ -0,0 +1,94 @@
+# Generate a single cumulative delta update covering a range of versions, using
+# existing incremental update files.
+
+from os.path import exists as path_exists, join as pathjoin
+from zipfile import ZipFile
+
+from gen_delta_update import dirs_and_files_for_full_version, find_changes
+from manifest import get_version_manifests
+from util import ALL_ZIP_NAMES, copy_zip_member
+
+
+def open_incremental_updates(resource_path, ver_old, ver_new) -> list:
+    """Open incremental update files (`<ver>/<ver>.zip`) for all versions after ver_old,
+    up to and including ver_new.
+
+    Returns list of ZipFile, newest first.
+    """
+    updates = []
+    for ver in range(ver_new, ver_old, -1):
+        path = pathjoin(resource_path, str(ver), f'{ver}.zip')
+        if path_exists(path):
+            updates.append(ZipFile(path, 'r'))
+    return updates
+
+
+def find_latest_source(updates, name, details=None):
+    """Find latest version of file `name` in incremental updates (newest first).
+
+    If details (size, CRC) are given, the file found must match them.
+    Returns (ZipFile, ZipInfo), or None if not found.
+    """
+    for zf in updates:
+        info = zf.NameToInfo.get(name)
+        if info is None:
+            continue
+        if details is not None and (info.file_size, info.CRC) != tuple(details):
+            raise ValueError(f'Latest {name} in {zf.filename} does not match manifest')
+        return (zf, info)
+    return None
+
+
+def compact_delta_chain(resource_path, ver_old, ver_new):
+    """Generate a delta update from ver_old to ver_new, combining the incremental
+    updates in between.
+
+    Changes are found by comparing the versions' manifests (full .zip archives aren't
+    needed), and file contents are taken from the newest incremental update that
+    contains them.
+    """
+    print(f'Compacting delta updates from {ver_old} to {ver_new}...')
+
+    old_path = pathjoin(resource_path, str(ver_old))
+    new_path = pathjoin(resource_path, str(ver_new))
+    old_manifests, new_manifests = get_version_manifests([old_path, new_path],
+                                                         ALL_ZIP_NAMES)
+
+    old_dirs, old_files = dirs_and_files_for_full_version(old_manifests)
+    new_dirs, new_files = dirs_and_files_for_full_version(new_manifests)
+
+    created_dirs, modified_files, deleted_files = find_changes(old_dirs, old_files,
+                                                               new_dirs, new_files)
+
+    print('Writing output...')
+    updates = open_incremental_updates(resource_path, ver_old, ver_new)
+    out_path = pathjoin(new_path, f'compact_{ver_old+1}_{ver_new}.zip')
+    zf = ZipFile(out_path, 'w')
+    try:
+        for k in created_dirs:
+            source = find_latest_source(updates, k)
+            zf.mkdir(source[1] if source else k)
+        for k in modified_files:
+            source = find_latest_source(updates, k, new_files[k])
+            if source is None:
+                raise ValueError(f'{k} not found in any incremental update')
+            # copy compressed data directly
+            copy_zip_member(*source, zf)
+        for k in deleted_files:
+            zf.writestr(k, b'')  # replace with empty file to free up space on user devices
+    finally:
+        zf.close()
+        for update in updates:
+            update.close()
+    print('Done!')
+
+
+if __name__ == '__main__':
+    from sys import argv
+
+    if len(argv) != 4:
+        print('Usage: python compact_delta_chain.py <resource_path> <ver_old> <ver_new>')
+        print('Example: python compact_delta_chain.py res 729 734')
+        exit()
+
+    compact_delta_chain(argv[1], int(argv[2]), int(argv[3]))
@@ -39,6 +39,7 @@ def upd_tutorial2():
 
     (Don't worry about overwriting it, tutorial_2 contains nothing of real value.)
     """
+    from os import cpu_count
     from recrypt_zip import recrypt_zip
     from util import replace_files_in_zip
 
@@ -46,8 +47,8 @@ def upd_tutorial2():
     # add it to `tutorial_2.zip`
     replace_files_in_zip(TUTORIAL2_PATH, read_apk_json_dir(), if_exists=False)
 
-    # 2. `python recrypt_zip.py tutorial/tutorial_2.zip`
-    recrypt_zip(TUTORIAL2_PATH)
+    # 2. `python recrypt_zip.py --jobs <cpu count> tutorial/tutorial_2.zip`
+    recrypt_zip(TUTORIAL2_PATH, jobs=cpu_count())
 
 
 def upd_730():
@@ -56,6 +57,7 @@ def upd_730():
     Version 730 takes original data and re-encrypts it with a key we control (no other
     changes).
     """
+    from os import cpu_count
     from os.path import join as path_join
     from gen_delta_update import gen_delta_update
     from new_ver import new_ver
@@ -83,8 +85,8 @@ def upd_730():
     zip_path = path_join(RESOURCE_PATH, '730', '1_json03.zip')
     replace_files_in_zip(zip_path, replacements, if_exists=False)
 
-    # 3. `python recrypt_ver.py res 730`
-    recrypt_ver(RESOURCE_PATH, 730)
+    # 3. `python recrypt_ver.py --jobs <cpu count> res 730`
+    recrypt_ver(RESOURCE_PATH, 730, jobs=cpu_count())
 
     # 4. `python gen_delta_update.py res 729 730`
     gen_delta_update(RESOURCE_PATH, 729, 730)
@@ -135,6 +137,7 @@ def upd_733():
 
     Version 732 sets up gacha (premium gacha rotation and birthday stepup gacha).
     """
+    from os import cpu_count
     from gen_delta_update import gen_delta_update
     from gen_gacha_birthday_stepup import gen_gacha_birthday_stepup
     from gen_gacha_rotation import gen_gacha_rotation
@@ -143,8 +146,8 @@ def upd_733():
     # 1. `python new_ver.py res 732 733`
     new_ver(RESOURCE_PATH, 732, 733)
 
-    # 2. `python gen_gacha_rotation.py res 733 2026 2031`
-    gen_gacha_rotation(RESOURCE_PATH, 733, 2026, 2031)
+    # 2. `python gen_gacha_rotation.py --jobs <cpu count> res 733 2026 2031`
+    gen_gacha_rotation(RESOURCE_PATH, 733, 2026, 2031, jobs=cpu_count())
 
     # 3. `python gen_gacha_birthday_stepup.py res 733 2026 2031`
     gen_gacha_birthday_stepup(RESOURCE_PATH, 733, 2026, 2031)
@@ -1,13 +1,19 @@
 # Decrypt/encrypt extracted json file(s) without changing key.
 # Operation is inferred based on presence/lack of '.dec.json' extension.
 
+from binascii import a2b_hex, b2a_hex
 import codecs
 from hashlib import sha256
 
 from Crypto.PublicKey import RSA
 from Crypto.Cipher import AES
 from Crypto.Util.number import bytes_to_long, long_to_bytes
-from Crypto.Util.Padding import pad, unpad
+
+from disk_cache import append_cache_file, read_cache_file, write_cache_file
+from key_wrap import KeyWrapper
+
+# size of encrypted (hexadecimal) data read at once when decrypting from a stream
+STREAM_CHUNK_SIZE = 256*1024
 
 def pubkey_bytes():
     with open('keys/server-public-key.pem', 'rb') as f:
@@ -22,8 +28,10 @@ pubkey_cipher = RSA.importKey(pubkey_bytes())
 # wrap in try because privkey isn't needed for decryption
 try:
     privkey_cipher = RSA.importKey(privkey_bytes())
+    privkey_wrapper = KeyWrapper(privkey_cipher)
 except Exception:
     privkey_cipher = None
+    privkey_wrapper = None
     print('Unable to load server-private-key. Encryption will not be possible.')
 
 
@@ -38,36 +46,190 @@ def gen_new_aes_key(json_bytes):
 
 def encrypt_new_aes_key(key_bytes):
     """Encrypt AES key to hexadecimal .c file content."""
-    key_bytes = b'\x00\x01' + b'\xff'*(256-32-3) + b'\x00' + key_bytes
-    key_long = bytes_to_long(key_bytes)
-    key_enc = privkey_cipher._decrypt_to_bytes(key_long)
-    return codecs.encode(key_enc, 'hex')
-
+    return encrypt_new_aes_keys([key_bytes])[0]
+
+def encrypt_new_aes_keys(keys):
+    """Encrypt list of AES keys, returning list of hexadecimal .c file contents."""
+    c_list = privkey_wrapper.wrap_aes_keys(keys)
+    # remember keys, so they don't need to be decrypted if the files are read later
+    fingerprint = key_fingerprint(privkey_cipher)
+    for key_bytes, c_bytes in zip(keys, c_list):
+        _add_cached_aes_key(fingerprint, c_bytes, key_bytes)
+    return c_list
+
+
+def key_fingerprint(rsa_key):
+    """Get short hexadecimal string identifying an RSA key (by its public key)."""
+    return sha256(long_to_bytes(rsa_key.n) + long_to_bytes(rsa_key.e)).hexdigest()[:16]
+
+# cached AES keys: {key fingerprint: {sha256 of .c content: AES key}}
+# also stored on disk, one "<.c hash> <AES key hex>" line per key
+_aes_key_cache = {}
+
+def _is_hex_digest(s):
+    """Check whether string is 64 hexadecimal digits (a sha256 hash or 32-byte key)."""
+    return len(s) == 64 and all(c in '0123456789abcdef' for c in s)
+
+def _aes_key_cache_for(fingerprint):
+    """Get dictionary of cached AES keys for RSA key fingerprint, loading from disk."""
+    cache = _aes_key_cache.get(fingerprint)
+    if cache is None:
+        cache = {}
+        cache_data = read_cache_file(f'aes_keys_{fingerprint}.txt')
+        for line in (cache_data or b'').decode('ascii').splitlines():
+            line = line.split()
+            # ignore any partially written lines
+            if len(line) == 2 and _is_hex_digest(line[0]) and _is_hex_digest(line[1]):
+                cache[line[0]] = bytes.fromhex(line[1])
+        _aes_key_cache[fingerprint] = cache
+    return cache
+
+def _add_cached_aes_key(fingerprint, c_bytes, key):
+    """Store AES key for given .c file content in cache."""
+    c_hash = sha256(c_bytes).hexdigest()
+    cache = _aes_key_cache_for(fingerprint)
+    if c_hash not in cache:
+        cache[c_hash] = bytes(key)
+        append_cache_file(f'{c_hash} {key.hex()}\n'.encode('ascii'),
+                          f'aes_keys_{fingerprint}.txt')
+
+def unwrap_aes_key(c_bytes, rsa_key):
+    """Get AES key for decryption, given .c file content and RSA (public) key.
+
+    Keys are cached (on disk), so each .c file only needs to be decrypted once.
+    """
+    fingerprint = key_fingerprint(rsa_key)
+    key = _aes_key_cache_for(fingerprint).get(sha256(c_bytes).hexdigest())
+    if key is None:
+        c_long = bytes_to_long(codecs.decode(c_bytes, 'hex'))
+        key = long_to_bytes(rsa_key._encrypt(c_long))[-32:]
+        _add_cached_aes_key(fingerprint, c_bytes, key)
+    return key
 
 def get_aes_key(c_bytes):
     """Get AES key for decryption, given .c file content."""
-    c_long = bytes_to_long(codecs.decode(c_bytes, 'hex'))
-    key = long_to_bytes(pubkey_cipher._encrypt(c_long))
-    return key[-32:]
+    return unwrap_aes_key(c_bytes, pubkey_cipher)
+
 
+def _unpad_in_place(buf):
+    """Remove PKCS#7 padding from end of bytearray, without copying."""
+    pad_len = buf[-1] if buf else 0
+    if not 1 <= pad_len <= AES.block_size or buf[-pad_len:] != bytes([pad_len]) * pad_len:
+        raise ValueError('Padding is incorrect.')
+    del buf[-pad_len:]
 
 def decrypt_json_bytes_aeskey(json_bytes, key):
-    """Decrypt JSON file bytes to bytes, using given AES key directly (not .c contents)."""
+    """Decrypt JSON file bytes to bytearray, using given AES key directly (not .c contents)."""
+    # hex is decoded a chunk at a time into a single buffer, which is then decrypted in
+    # place (so only one full-size copy of the data is made)
+    buf = bytearray(len(json_bytes) // 2)
+    hex_view = memoryview(json_bytes)
+    for pos in range(0, len(buf), STREAM_CHUNK_SIZE):
+        end = pos + STREAM_CHUNK_SIZE
+        buf[pos:end] = a2b_hex(hex_view[pos*2:end*2])
+    AES.new(key, AES.MODE_ECB).decrypt(buf, output=buf)
+    _unpad_in_place(buf)
+    return buf
+
+def iter_decrypt_json_stream(json_stream, key, chunk_size=STREAM_CHUNK_SIZE):
+    """Decrypt JSON file from binary stream (such as an open .zip member) in chunks,
+    using given AES key directly (not .c contents).
+
+    Yields decrypted chunks, with padding removed from the last one.
+    Only one chunk of the file is held in memory at a time.
+    """
     cipher = AES.new(key, AES.MODE_ECB)
-    dec = cipher.decrypt(codecs.decode(json_bytes, 'hex'))
-    return unpad(dec, 16)
+    # hex digits of a partial AES block left over from the previous read
+    rest = b''
+    # last decrypted block is held back until the end, because it contains padding
+    last_block = None
+
+    while chunk := json_stream.read(chunk_size):
+        if rest:
+            chunk = rest + chunk
+        usable = len(chunk) - len(chunk) % (AES.block_size * 2)
+        rest = chunk[usable:]
+        if not usable:
+            continue
+
+        dec = bytearray(usable // 2)
+        cipher.decrypt(a2b_hex(memoryview(chunk)[:usable]), output=dec)
+
+        if last_block is not None:
+            yield last_block
+        last_block = dec[-AES.block_size:]
+        del dec[-AES.block_size:]
+        if dec:
+            yield dec
+
+    if rest or last_block is None:
+        raise ValueError('Data must be padded to 16 byte boundary in ECB mode')
+
+    _unpad_in_place(last_block)
+    if last_block:
+        yield last_block
 
 def encrypt_json_bytes_aeskey(json_bytes, key):
     """Encrypt bytes to JSON file bytes, using given AES key directly (not .c contents)."""
     cipher = AES.new(key, AES.MODE_ECB)
-    enc = cipher.encrypt(pad(json_bytes, 16))
-    return codecs.encode(enc, 'hex')
+    # full blocks are encrypted straight from the input, only the last one is padded
+    full_len = len(json_bytes) - len(json_bytes) % AES.block_size
+    pad_len = AES.block_size - len(json_bytes) % AES.block_size
+    enc = bytearray(full_len + AES.block_size)
+    enc_view = memoryview(enc)
+    cipher.encrypt(memoryview(json_bytes)[:full_len], output=enc_view[:full_len])
+    cipher.encrypt(bytes(json_bytes[full_len:]) + bytes([pad_len]) * pad_len,
+                   output=enc_view[full_len:])
+    return b2a_hex(enc)
+
+
+def encrypt_json(json_bytes):
+    """Encrypt bytes with a new key, returning (JSON file bytes, .c file bytes)."""
+    return encrypt_json_list([json_bytes])[0]
+
+def encrypt_json_list(json_list):
+    """Encrypt list of bytes with new keys, returning list of (JSON, .c) file bytes.
+
+    The AES key is derived from the content, so identical content always encrypts to
+    the same result. Results are cached (on disk) by content hash for the current
+    private key, so unchanged content is never encrypted twice.
+    """
+    cache_dir = f'encrypted_{key_fingerprint(privkey_cipher)}'
+    out = [None] * len(json_list)
+    missing = []
+
+    for i, json_bytes in enumerate(json_list):
+        content_hash = sha256(json_bytes).hexdigest()
+        json_enc = read_cache_file(cache_dir, content_hash[:2], content_hash + '.json')
+        c_bytes = read_cache_file(cache_dir, content_hash[:2], content_hash + '.c')
+        if json_enc is not None and c_bytes is not None:
+            out[i] = (json_enc, c_bytes)
+        else:
+            missing.append((i, content_hash))
+
+    keys = [gen_new_aes_key(json_list[i]) for i, _ in missing]
+    c_list = encrypt_new_aes_keys(keys)
+
+    for (i, content_hash), key, c_bytes in zip(missing, keys, c_list):
+        json_enc = encrypt_json_bytes_aeskey(json_list[i], key)
+        write_cache_file(json_enc, cache_dir, content_hash[:2], content_hash + '.json')
+        write_cache_file(c_bytes, cache_dir, content_hash[:2], content_hash + '.c')
+        out[i] = (json_enc, c_bytes)
+
+    return out
 
 
 def decrypt_json(json_bytes, c_bytes):
     """Decrypt JSON file bytes to string, using key from .c file contents."""
     return decrypt_json_bytes_aeskey(json_bytes, get_aes_key(c_bytes)).decode('utf-8')
 
+def decrypt_json_stream(json_stream, c_bytes):
+    """Decrypt JSON file from binary stream to string, using key from .c file contents."""
+    dec = bytearray()
+    for chunk in iter_decrypt_json_stream(json_stream, get_aes_key(c_bytes)):
+        dec += chunk
+    return dec.decode('utf-8')
+
 
 if __name__ == '__main__':
     from sys import argv
@@ -125,9 +287,7 @@ if __name__ == '__main__':
             with open(json_path, 'rb') as f:
                 json_bytes = f.read()
 
-            aeskey = gen_new_aes_key(json_bytes)
-            c_bytes = encrypt_new_aes_key(aeskey)
-            enc_bytes = encrypt_json_bytes_aeskey(json_bytes, aeskey)
+            enc_bytes, c_bytes = encrypt_json(json_bytes)
 
             with open(c_path, 'wb') as f:
                 f.write(c_bytes)
@@ -1,8 +1,14 @@
-# Delete full resource files except for earliest and latest version.
-# Incremental update files are kept for for all versions.
+# Delete full resource files except for earliest and latest version (and versions that
+# overlay versions are layered on).
+# Incremental update files are kept for for all versions, along with manifests of the
+# deleted files.
 
 from os import listdir, remove
-from os.path import isdir, isfile, join as path_join
+from os.path import basename, isdir, isfile, join as path_join
+
+from manifest import get_archive_manifest
+from overlay import is_overlay, version_layers
+from util import invalidate_resource_index
 
 
 def list_full_version_files(res_path, ver):
@@ -49,13 +55,29 @@ def list_full_versions(res_path):
     return fulllist
 
 
+def list_overlay_base_versions(res_path):
+    """Returns set of full versions that overlay versions in res_path are layered on,
+    as integer version numbers.
+    """
+    bases = set()
+    for ver in list_all_versions(res_path):
+        ver_path = path_join(res_path, str(ver))
+        if is_overlay(ver_path):
+            bases.add(int(basename(version_layers(ver_path)[0])))
+    return bases
+
+
 def delete_unneeded_full_res(resource_path):
     full_vers = list_full_versions(resource_path)
     if len(full_vers) <= 2:
         # nothing to do if only have two or fewer full versions
         return
 
-    vers_to_delete = full_vers[1:-1]
+    # full versions that overlay versions depend on must also be kept
+    overlay_bases = list_overlay_base_versions(resource_path)
+    vers_to_delete = [x for x in full_vers[1:-1] if x not in overlay_bases]
+    if not vers_to_delete:
+        return
     print('Deleting non-incremental files for', vers_to_delete)
 
     for ver in vers_to_delete:
@@ -64,6 +86,10 @@ def delete_unneeded_full_res(resource_path):
 
         for f in files_to_delete:
             file_path = path_join(ver_path, f)
+            # make sure manifest is up to date, so versions can still be compared
+            get_archive_manifest(file_path)
+            # archive can't be removed while open (on Windows)
+            invalidate_resource_index(file_path)
             remove(file_path)
 
 
@@ -0,0 +1,47 @@
+# Simple on-disk cache files, used to avoid repeating slow work between runs.
+# Everything in CACHE_PATH is safe to delete at any time.
+
+from os import makedirs, remove, replace
+from os.path import dirname, join as path_join
+from tempfile import mkstemp
+
+
+CACHE_PATH = 'cache'
+
+
+def cache_file_path(*parts) -> str:
+    """Return path of cache file (parts are joined), creating its directory."""
+    path = path_join(CACHE_PATH, *parts)
+    makedirs(dirname(path), exist_ok=True)
+    return path
+
+
+def read_cache_file(*parts) -> bytes | None:
+    """Read cache file, returning None if it doesn't exist."""
+    try:
+        with open(cache_file_path(*parts), 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def write_cache_file(data, *parts):
+    """Write cache file, replacing any existing file.
+
+    The file is replaced atomically, so a partially written file is never read.
+    """
+    path = cache_file_path(*parts)
+    fd, tmp_path = mkstemp(suffix='.tmp', dir=dirname(path))
+    try:
+        with open(fd, 'wb') as f:
+            f.write(data)
+        replace(tmp_path, path)
+    except BaseException:
+        remove(tmp_path)
+        raise
+
+
+def append_cache_file(data, *parts):
+    """Append data to the end of cache file, creating it if necessary."""
+    with open(cache_file_path(*parts), 'ab') as f:
+        f.write(data)
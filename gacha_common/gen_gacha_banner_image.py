@@ -1,5 +1,5 @@
 from colorsys import hls_to_rgb
-from io import BytesIO
+from functools import lru_cache
 import math
 import random
 from typing import List
@@ -7,7 +7,7 @@ from typing import List
 import colorgram
 from PIL import Image, ImageDraw, ImageFilter, ImageFont
 
-from util import read_file
+from image_util import load_bg_image, load_stand_image, split_bg_image_mask
 
 
 DEFAULT_BANNER_BG = 'bg_live_1'
@@ -37,6 +37,8 @@ BANNER_DESCRIPTION_TEXT_COLOUR = (255, 255, 255, 255)
 BANNER_DESCRIPTION_SPACE_QUOTES = False
 
 
+# gradients are cached, so returned image must not be modified
+@lru_cache(maxsize=64)
 def _draw_1px_vertical_gradient(height, colours) -> Image:
     image = Image.new('RGBA', (1, height), colours[0])
     if len(colours) == 1:
@@ -56,6 +58,8 @@ def _draw_1px_vertical_gradient(height, colours) -> Image:
 
     return image
 
+# gradients are cached, so returned image must not be modified
+@lru_cache(maxsize=64)
 def _draw_1px_horizontal_gradient(width, colours) -> Image:
     image = Image.new('RGBA', (width, 1), colours[0])
     if len(colours) == 1:
@@ -98,10 +102,25 @@ def _draw_vert_gradient_text(font, text, colours) -> Image:
     return output_image
 
 
-def _gen_gacha_title_text_image(title, outline_colour) -> Image.Image:
-    """Create Image of title (e.g. "プレミアムガチャ") text with gradient fill and strokes.
+def _draw_text_mask(size, pos, text, font, stroke_width=0) -> Image.Image:
+    """Create mask (L mode Image) of text, as drawn by ImageDraw.text.
 
-    title parameter sets "プレミアム" part only
+    Filling a colour through the mask gives the same result as drawing the text in that
+    colour directly.
+    """
+    mask_image = Image.new('L', size)
+    d = ImageDraw.Draw(mask_image)
+    d.text(pos, text, font=font, fill=255, stroke_fill=255, stroke_width=stroke_width)
+    return mask_image
+
+@lru_cache(maxsize=16)
+def _gen_gacha_title_sprites(title) -> (tuple, list, list):
+    """Create colour-independent parts of title text image for
+    _gen_gacha_title_text_image, so each title's text is only rendered once.
+
+    Returns image size, list of (mask, colour) for each text layer (colour is None for
+    the outline), and list of (gradient text image, position).
+    Results are cached, so they must not be modified.
     """
     title_bbox = BANNER_LARGE_FONT.getbbox(title)
     title_metrics = BANNER_LARGE_FONT.getmetrics()
@@ -125,61 +144,54 @@ def _gen_gacha_title_text_image(title, outline_colour) -> Image.Image:
     )
 
     # start by creating strokes for text
-    image = Image.new('RGBA', image_size, (0, 0, 0, 0))
-    d = ImageDraw.Draw(image)
-    d.text(
-        title_pos,
-        title,
-        font=BANNER_LARGE_FONT,
-        fill=outline_colour,
-        stroke_fill=outline_colour,
-        stroke_width=BANNER_TITLE_TOTAL_STROKE_WIDTH
-    )
-    d.text(
-        gacha_pos,
-        'ガチャ',
-        font=BANNER_MEDIUM_FONT,
-        fill=outline_colour,
-        stroke_fill=outline_colour,
-        stroke_width=BANNER_TITLE_TOTAL_STROKE_WIDTH
-    )
-    d.text(
-        title_pos,
-        title,
-        font=BANNER_LARGE_FONT,
-        fill=BANNER_TITLE_INNER_STROKE_COLOUR,
-        stroke_fill=BANNER_TITLE_INNER_STROKE_COLOUR,
-        stroke_width=BANNER_TITLE_INNER_STROKE_WIDTH
-    )
-    d.text(
-        gacha_pos,
-        'ガチャ',
-        font=BANNER_MEDIUM_FONT,
-        fill=BANNER_TITLE_INNER_STROKE_COLOUR,
-        stroke_fill=BANNER_TITLE_INNER_STROKE_COLOUR,
-        stroke_width=BANNER_TITLE_INNER_STROKE_WIDTH
-    )
+    # (outline colour is filled in later, so it's represented by None here)
+    text_masks = [
+        (_draw_text_mask(image_size, title_pos, title, BANNER_LARGE_FONT,
+                         BANNER_TITLE_TOTAL_STROKE_WIDTH), None),
+        (_draw_text_mask(image_size, gacha_pos, 'ガチャ', BANNER_MEDIUM_FONT,
+                         BANNER_TITLE_TOTAL_STROKE_WIDTH), None),
+        (_draw_text_mask(image_size, title_pos, title, BANNER_LARGE_FONT,
+                         BANNER_TITLE_INNER_STROKE_WIDTH), BANNER_TITLE_INNER_STROKE_COLOUR),
+        (_draw_text_mask(image_size, gacha_pos, 'ガチャ', BANNER_MEDIUM_FONT,
+                         BANNER_TITLE_INNER_STROKE_WIDTH), BANNER_TITLE_INNER_STROKE_COLOUR),
+    ]
     # then create the inner drop shadow
     for offset in range(-1, 2):
-        d.text(
-            (title_pos[0] + offset, title_pos[1] + offset),
-            title,
-            font=BANNER_LARGE_FONT,
-            fill=BANNER_TITLE_INNER_SHADOW_COLOUR
-        )
-        d.text(
-            (gacha_pos[0] + offset, gacha_pos[1] + offset),
-            'ガチャ',
-            font=BANNER_MEDIUM_FONT,
-            fill=BANNER_TITLE_INNER_SHADOW_COLOUR
-        )
-    # then create and composite the gradient text images
+        text_masks.append((
+            _draw_text_mask(image_size, (title_pos[0] + offset, title_pos[1] + offset),
+                            title, BANNER_LARGE_FONT),
+            BANNER_TITLE_INNER_SHADOW_COLOUR
+        ))
+        text_masks.append((
+            _draw_text_mask(image_size, (gacha_pos[0] + offset, gacha_pos[1] + offset),
+                            'ガチャ', BANNER_MEDIUM_FONT),
+            BANNER_TITLE_INNER_SHADOW_COLOUR
+        ))
+    # then create the gradient text images
     title_gradient_image = _draw_vert_gradient_text(BANNER_LARGE_FONT, title,
                                                     BANNER_TITLE_GRADIENT_COLOURS)
     gacha_gradient_image = _draw_vert_gradient_text(BANNER_MEDIUM_FONT, 'ガチャ',
                                                     BANNER_TITLE_GRADIENT_COLOURS)
-    image.alpha_composite(title_gradient_image, tuple(x - 1 for x in title_pos))
-    image.alpha_composite(gacha_gradient_image, tuple(x - 1 for x in gacha_pos))
+    gradient_images = [
+        (title_gradient_image, tuple(x - 1 for x in title_pos)),
+        (gacha_gradient_image, tuple(x - 1 for x in gacha_pos)),
+    ]
+
+    return (image_size, text_masks, gradient_images)
+
+def _gen_gacha_title_text_image(title, outline_colour) -> Image.Image:
+    """Create Image of title (e.g. "プレミアムガチャ") text with gradient fill and strokes.
+
+    title parameter sets "プレミアム" part only
+    """
+    image_size, text_masks, gradient_images = _gen_gacha_title_sprites(title)
+
+    # fill each text mask in order, then composite the gradient text images
+    image = Image.new('RGBA', image_size, (0, 0, 0, 0))
+    for mask, colour in text_masks:
+        image.paste(colour or outline_colour, mask=mask)
+    for gradient_image, pos in gradient_images:
+        image.alpha_composite(gradient_image, pos)
 
     return image
 
@@ -251,66 +263,6 @@ def _gen_banner_desc_text_image(text, bg_colour, outline_colour) -> Image.Image:
     return image
 
 
-def _load_bg_image(bg_io):
-    """Load, crop, and resize bg image to BANNER_BG_SIZE resolution RGBA.
-
-    Input is a file-like IO object.
-    """
-    image = Image.open(bg_io)
-    # convert to RGBA because input may be indexed colour
-    image = image.convert('RGBA')
-
-    w = BANNER_BG_SIZE[0]
-    h = BANNER_BG_SIZE[1]
-
-    # crop to correct aspect ratio (same as output)
-    crop_width = image.width
-    crop_height = int(image.width * (h / w))
-    if (crop_height > image.height):
-        crop_width = int(image.height * (w / h))
-        crop_height = image.height
-    crop_left = (image.width - crop_width) // 2
-    crop_upper = (image.height - crop_height) // 2
-    image = image.crop(
-        (crop_left, crop_upper, crop_left + crop_width, crop_upper + crop_height)
-    )
-    # resize
-    image = image.resize((w, h))
-
-    return image
-
-def _split_bg_image_mask(size, split_pos, angle):
-    """Generates a mask for split background so only the right side is visible.
-
-    - size is (width, height)
-    - split_pos sets the position in pixels from the left edge
-    - angle sets the angle of the split in degrees from vertical (positive=slant to right)
-    """
-    # compute constants
-    # (note: use pixel centres for calculation, so total distance is one less than height)
-    x_offset_per_y = math.tan(math.radians(angle))
-    x_offset_top = x_offset_per_y * (size[1] - 1) / 2
-    x_offset_top += split_pos * size[0]
-
-    # start with an empty background
-    mask_image = Image.new('RGBA', size)
-
-    pixels = mask_image.load()
-    for y in range(size[1]):
-        x_offset = x_offset_top - y * x_offset_per_y
-        if x_offset >= size[0]: continue  # no pixels to fill on this line
-        if x_offset < 0: x_offset = 0
-
-        # partially fill left-most pixel based on coverage
-        cov = 1 - (x_offset % 1)
-        pixels[int(x_offset), y] = (0, 0, 0, int(255 * cov))
-
-        # completely fill rest of row
-        for x in range(math.ceil(x_offset), size[0]):
-            pixels[x, y] = (0, 0, 0, 255)
-
-    return mask_image
-
 def _clamp_colour_lightness(colour: colorgram.Color, min: int, max: int) -> colorgram.Color:
     """Clamps lightness of colour to be within given range (inclusive)."""
     if colour.hsl.l < min:
@@ -351,23 +303,6 @@ def _clamp_colour_sat(colour: colorgram.Color, min: int, max: int) -> colorgram.
     proportion = colour.proportion
     return colorgram.Color(*rgb, proportion)
 
-def _filter_stand_bg_rings(image: Image.Image) -> Image.Image:
-    # ensure RGBA
-    image = image.convert('RGBA')
-
-    pixels = image.load()
-    for x in range(image.width):
-        for y in range(image.height):
-            colour = pixels[x, y]
-            alpha = colour[3]
-            alpha = round(alpha * 2.1 - 150)
-            alpha = max(alpha, 0)
-            alpha = min(alpha, 255)
-            colour = colour[0:3] + (alpha,)
-            pixels[x, y] = colour
-
-    return image
-
 def gen_gacha_banner_image(
         bg_name: str,
         card_image_files: List[str],
@@ -383,14 +318,14 @@ def gen_gacha_banner_image(
     # separate on slash character, used to denote multiple backgrounds
     bg_names = bg_name.split('/')
 
-    bg_bytes = read_file(resource_path, ver, f'image/bg/{bg_names[0]}.png')
-    bg_image = _load_bg_image(BytesIO(bg_bytes))
+    bg_image = load_bg_image(resource_path, ver, f'image/bg/{bg_names[0]}.png',
+                             BANNER_BG_SIZE)
     # if there's multiple backgrounds, paste them over, left-to-right
     for i, bg_name in enumerate(bg_names[1:]):
-        split_bytes = read_file(resource_path, ver, f'image/bg/{bg_name}.png')
-        split_image = _load_bg_image(BytesIO(split_bytes))
-        split_mask = _split_bg_image_mask((bg_image.width, bg_image.height),
-                                          i + 1 / len(bg_names), 20)
+        split_image = load_bg_image(resource_path, ver, f'image/bg/{bg_name}.png',
+                                    BANNER_BG_SIZE)
+        split_mask = split_bg_image_mask((bg_image.width, bg_image.height),
+                                         i + 1 / len(bg_names), 20)
         bg_image.paste(split_image, mask=split_mask)
 
     # make a copy of bg with reduced opacity, blur it a lot, paste to banner,
@@ -444,20 +379,15 @@ def gen_gacha_banner_image(
     saturated_dominant_colour = _clamp_colour_sat(saturated_dominant_colour, 127, 191)
 
     # load and resize card images
-    card_image_bytes = [read_file(resource_path, ver, f) for f in card_image_files]
-    card_images = [Image.open(BytesIO(b)) for b in card_image_bytes]
-    for i, image in enumerate(card_images):
-        image = image.convert('RGBA')
-        if len(card_images) <= 2:
+    card_images = []
+    for f in card_image_files:
+        if len(card_image_files) <= 2:
             scale_width = int(banner_image.height * 1.35)
-        elif len(card_images) == 3:
+        elif len(card_image_files) == 3:
             scale_width = int(banner_image.height * 1.2)
         else:
             scale_width = banner_image.height
-        scale_height = image.height * scale_width // image.width
-        image = image.resize((scale_width, scale_height))
-        image = _filter_stand_bg_rings(image)
-        card_images[i] = image
+        card_images.append(load_stand_image(resource_path, ver, f, scale_width))
 
     # insert a dummy image in first or third slot sometimes if 1 or 3 images
     # to randomise which side has only a single image
@@ -1,34 +1,24 @@
 # Generate delta update file between two versions
 
-from hashlib import sha256
-from io import BytesIO
 from os.path import join as pathjoin
 from zipfile import ZipFile
 
-from util import ALL_ZIP_NAMES
+from manifest import get_version_manifests
+from util import ALL_ZIP_NAMES, copy_zip_member, get_resource_index, \
+                 invalidate_resource_index
 
 
-def dirs_and_files_for_zipfile(zf: ZipFile) -> (dict, dict):
-    """Return dictionary of directory name to ZipInfo for all directories and
-    dictionary of filename to (ZipInfo, sha256 hash) for all files in zip file.
-    """
-    dirs = {}
-    files = {}
+# share of delta size (compressed) at which a single file is listed in reports
+DOMINANT_SHARE = 0.1
 
-    for f in zf.infolist():
-        fname = f.filename
-        if f.is_dir():
-            dirs[fname] = f
-        else:
-            fhash = sha256(zf.read(f)).digest()
-            files[fname] = (f, fhash)
 
-    return (dirs, files)
+def dirs_and_files_for_full_version(manifests: dict, strict=False) -> (dict, dict):
+    """Return dictionary with all directory names as keys and dictionary of filename to
+    details for all files in a version, given manifests of all its zip files
+    ({zip name: manifest}).
 
-def dirs_and_files_for_full_version(path: str) -> (dict, dict):
-    """Return dictionary of directory name to ZipInfo for all directories and
-    dictionary of filename to (ZipInfo, sha256 hash) for all files in zip files
-    corresponding to given verison path.
+    Details are (size, CRC), or (size, CRC, sha256 hash) if strict is true.
+    Both are in archive order, so output generated from them is reproducible.
     """
     # collect details of all files, as they should exist in game's local copy to avoid
     # potential issues with moved/duplicated files that won't really be applied in fresh
@@ -36,83 +26,137 @@ def dirs_and_files_for_full_version(path: str) -> (dict, dict):
     dirs = {}
     files = {}
 
+    details_len = 3 if strict else 2
     for zipname in ALL_ZIP_NAMES:
-        zippath = pathjoin(path, zipname)
-        zf = ZipFile(zippath, 'r')
-        sub_dirs, sub_files = dirs_and_files_for_zipfile(zf)
-        zf.close()
-
-        dirs.update(sub_dirs)
-        files.update(sub_files)
+        manifest = manifests[zipname]
+        dirs.update(dict.fromkeys(manifest['dirs']))
+        files.update({k: tuple(v[:details_len]) for k, v in manifest['files'].items()})
 
     return (dirs, files)
 
-def get_file_list_contents(path: str, files: [str]) -> dict:
-    """Return dictionary of filename to file content (bytes) for each file in list.
-    File content is taken from update zip files at path.
+def find_changes(old_dirs, old_files, new_dirs, new_files) -> (list, list, list):
+    """Compare two versions and print a summary of changes, given directories and files
+    of each (from `dirs_and_files_for_full_version`).
+
+    Returns lists of created directories, modified (or new) files, and deleted files.
     """
-    contents = {}
+    created_dirs = [k for k in new_dirs
+                    if k not in old_dirs]
+    modified_files = [k for k, v in new_files.items()
+                      if old_files.get(k) != v]
+    deleted_files = [k for k in old_files.keys()
+                     if k not in new_files]
 
-    for zipname in ALL_ZIP_NAMES:
-        zippath = pathjoin(path, zipname)
-        zf = ZipFile(zippath, 'r')
+    print(f'  Created dirs: {len(created_dirs)}')
+    print(f'  Modified files: {len(modified_files)}')
+    print(f'  Deleted files: {len(deleted_files)}')
+    print()
 
-        for fname in files:
-            try:
-                contents[fname] = zf.read(fname)
-            except KeyError:
-                continue
+    return (created_dirs, modified_files, deleted_files)
 
-    return contents
+def _format_size(size):
+    """Format byte count for display."""
+    if size < 1024:
+        return f'{size} B'
+    for unit in ['KB', 'MB', 'GB']:
+        size /= 1024
+        if size < 1024 or unit == 'GB':
+            return f'{size:.1f} {unit}'
 
+def print_delta_report(modified_files, new_index, old_files):
+    """Print sizes of modified files in a delta update, grouped by archive, and list
+    files that make up a large share of the delta.
 
-def gen_delta_update(resource_path, ver_old, ver_new):
+    Sizes are compressed sizes (as downloaded by players).
+    """
+    lookup = new_index.lookup()
+    total = sum(lookup[k][2].compress_size for k in modified_files)
+
+    by_archive = {}
+    for k in modified_files:
+        zip_name, _, info = lookup[k]
+        count, size = by_archive.get(zip_name, (0, 0))
+        by_archive[zip_name] = (count + 1, size + info.compress_size)
+
+    print(f'Delta size: {_format_size(total)}')
+    for zip_name in ALL_ZIP_NAMES:
+        if zip_name in by_archive:
+            count, size = by_archive[zip_name]
+            print(f'  {zip_name}: {count} files, {_format_size(size)}')
+
+    dominant = [k for k in modified_files
+                if total and lookup[k][2].compress_size >= total * DOMINANT_SHARE]
+    dominant.sort(key=lambda k: lookup[k][2].compress_size, reverse=True)
+    if dominant:
+        print(f'Files making up at least {DOMINANT_SHARE:.0%} of delta:')
+    for k in dominant:
+        zip_name, _, info = lookup[k]
+        if k in old_files:
+            change = f'{_format_size(old_files[k][0])} -> {_format_size(info.file_size)}'
+        else:
+            change = f'new, {_format_size(info.file_size)}'
+        print(f'  {k} ({zip_name}): {_format_size(info.compress_size)} '
+              f'({info.compress_size / total:.0%}), uncompressed {change}')
+    print()
+
+def gen_delta_update(resource_path, ver_old, ver_new, strict=False, report=False):
+    """Generate delta update file between two versions.
+
+    Files are normally compared by size and CRC. If strict is true, files with the
+    same size and CRC are also compared by sha256 hash.
+    If report is true, sizes of modified files are also printed (see
+    `print_delta_report`).
+    """
     print(f'Generating delta update from {ver_old} to {ver_new}...')
     print('Scanning for changes between versions...')
 
+    # manifests are read (or archives scanned, if necessary) for both versions at once
     old_path = pathjoin(resource_path, str(ver_old))
-    old_dirs, old_files = dirs_and_files_for_full_version(old_path)
-
     new_path = pathjoin(resource_path, str(ver_new))
-    new_dirs, new_files = dirs_and_files_for_full_version(new_path)
+    old_manifests, new_manifests = get_version_manifests([old_path, new_path],
+                                                         ALL_ZIP_NAMES, hashes=strict)
 
-    created_dirs = {k: v for k, v in new_dirs.items()
-                    if k not in old_dirs}
-    modified_files = {k: v for k, v in new_files.items()
-                      if old_files.get(k, (None, None))[1] != v[1]}
-    deleted_files = [k for k in old_files.keys()
-                     if k not in new_files]
+    old_dirs, old_files = dirs_and_files_for_full_version(old_manifests, strict)
+    new_dirs, new_files = dirs_and_files_for_full_version(new_manifests, strict)
 
     print('Done!')
-    print(f'  Created dirs: {len(created_dirs)}')
-    print(f'  Modified files: {len(modified_files)}')
-    print(f'  Deleted files: {len(deleted_files)}')
-    print()
+    created_dirs, modified_files, deleted_files = find_changes(old_dirs, old_files,
+                                                               new_dirs, new_files)
 
-    print('Loading modified files...')
-    new_contents = get_file_list_contents(new_path, modified_files.keys())
-    print('Done!')
-    print()
+    # changed files are found using the new version's (shared) archive index, so each
+    # is read exactly once
+    new_index = get_resource_index(resource_path, ver_new)
+
+    if report:
+        print_delta_report(modified_files, new_index, old_files)
 
     print('Writing output...')
     out_path = pathjoin(new_path, str(ver_old+1)) + '.zip'
     zf = ZipFile(out_path, 'w')
-    for k, v in created_dirs.items():
-        zf.mkdir(v)
-    for k, v in modified_files.items():
-        zf.writestr(v[0], new_contents[k])
+    for k in created_dirs:
+        zf.mkdir(new_index.find(k)[1])
+    for k in modified_files:
+        # copy compressed data directly
+        copy_zip_member(*new_index.find(k), zf)
     for k in deleted_files:
         zf.writestr(k, b'')  # replace with empty file to free up space on user devices
     zf.close()
+    # don't leave the new version's archives open (so they can be deleted later)
+    invalidate_resource_index(pathjoin(new_path, ALL_ZIP_NAMES[0]))
     print('Done!')
 
 
 if __name__ == '__main__':
     from sys import argv
 
-    if len(argv) != 4:
-        print('Usage: python gen_delta_update.py <resource_path> <ver_old> <ver_new>')
+    args = argv[1:]
+    strict = '--strict' in args
+    report = '--report' in args
+    args = [x for x in args if x not in ('--strict', '--report')]
+
+    if len(args) != 3:
+        print('Usage: python gen_delta_update.py [--strict] [--report] <resource_path> <ver_old> <ver_new>')
         print('Example: python gen_delta_update.py res 729 730')
         exit()
 
-    gen_delta_update(argv[1], int(argv[2]), int(argv[3]))
+    gen_delta_update(args[0], int(args[1]), int(args[2]), strict, report)
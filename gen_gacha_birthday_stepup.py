@@ -9,7 +9,6 @@ from decimal import Decimal
 from io import BytesIO
 import json
 import math
-from os.path import join as path_join
 import random
 from typing import Dict, List
 
@@ -22,8 +21,7 @@ from gacha_common.gen_stepup_gacha_banner_image import gen_stepup_gacha_banner_i
 from gacha_common.gen_gacha_description_text import \
     gen_gacha_stepup_description_text_combined
 from gacha_common.gen_gacha_per_table import gen_gacha_stepup_per_table
-from util import encrypt_replacements_json, read_json_decrypted, \
-                 replace_files_in_ver, replace_files_in_zip
+from util import VerTransaction, encrypt_replacements_json, read_json_parsed
 
 
 try:
@@ -790,16 +788,11 @@ def _gen_markdown_page_ja(stepup_gacha_unique_entires: List[dict]) -> str:
 
 
 def gen_gacha_birthday_stepup(resource_path, ver, start_year, end_year):
-    master_chara = read_json_decrypted(resource_path, ver, 'json/master_chara.json')
-    master_chara = json.loads(master_chara)
-    master_series = read_json_decrypted(resource_path, ver, 'json/master_series.json')
-    master_series = json.loads(master_series)
-    master_gacha_main = read_json_decrypted(resource_path, ver, 'json/master_gacha_main.json')
-    master_gacha_main = json.loads(master_gacha_main)
-    master_gacha_type2_1 = read_json_decrypted(resource_path, ver, 'json/master_gacha_type2_1.json')
-    master_gacha_type2_1 = json.loads(master_gacha_type2_1)
-    master_gacha_type2_detail = read_json_decrypted(resource_path, ver, 'json/master_gacha_type2_detail.json')
-    master_gacha_type2_detail = json.loads(master_gacha_type2_detail)
+    master_chara = read_json_parsed(resource_path, ver, 'json/master_chara.json')
+    master_series = read_json_parsed(resource_path, ver, 'json/master_series.json')
+    master_gacha_main = read_json_parsed(resource_path, ver, 'json/master_gacha_main.json')
+    master_gacha_type2_1 = read_json_parsed(resource_path, ver, 'json/master_gacha_type2_1.json')
+    master_gacha_type2_detail = read_json_parsed(resource_path, ver, 'json/master_gacha_type2_detail.json')
 
     permanent_gacha_data = load_and_parse_gacha_data_csv(PERMANENT_CSV_PATH)
     set_card_names_from_master_chara(permanent_gacha_data, master_chara)
@@ -850,6 +843,8 @@ def gen_gacha_birthday_stepup(resource_path, ver, start_year, end_year):
         banner_image.save(f'gacha_md/static/gacha/img_banner2_{first_id}.png')
 
 
+    transaction = VerTransaction(resource_path, ver)
+
     # add gacha detail sheets
     replacements = {}
     for entry in stepup_gacha_unique_entires:
@@ -858,8 +853,7 @@ def gen_gacha_birthday_stepup(resource_path, ver, start_year, end_year):
         first_id = entry["first_gacha_id"]
         replacements[f'json/master_gacha_type2_{first_id}.json'] = json.dumps(full_table)
     replacements = encrypt_replacements_json(replacements)
-    zip_path = path_join(resource_path, str(ver), '1_json01.zip')
-    replace_files_in_zip(zip_path, replacements, if_exists=False)
+    transaction.add_files('1_json01.zip', replacements)
 
     # add step details
     for row in master_gacha_rows:
@@ -869,14 +863,14 @@ def gen_gacha_birthday_stepup(resource_path, ver, start_year, end_year):
     replacements = encrypt_replacements_json({
         'json/master_gacha_type2_detail.json': json.dumps(master_gacha_type2_detail)
     })
-    replace_files_in_ver(resource_path, ver, replacements)
+    transaction.replace_files(replacements)
 
     # merge and replace master_gacha_main
     master_gacha_main.extend(master_gacha_rows)
     replacements = encrypt_replacements_json({
         'json/master_gacha_main.json': json.dumps(master_gacha_main)
     })
-    replace_files_in_ver(resource_path, ver, replacements)
+    transaction.replace_files(replacements)
 
     # add images
     replacements = {}
@@ -885,8 +879,10 @@ def gen_gacha_birthday_stepup(resource_path, ver, start_year, end_year):
         entry['banner_image'].save(io, format='PNG')
         first_id = entry["first_gacha_id"]
         replacements[f'image/event/gacha/2/img_banner2_{first_id}.png'] = io.getvalue()
-    zip_path = path_join(resource_path, str(ver), '1_pkg.zip')
-    replace_files_in_zip(zip_path, replacements, if_exists=False)
+    transaction.add_files('1_pkg.zip', replacements)
+
+    # write all changes
+    transaction.commit()
 
 if __name__ == '__main__':
     from sys import argv
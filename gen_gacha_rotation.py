@@ -6,12 +6,12 @@
 #  - Limited cards will be available in gacha alongside the permanent lineup
 #  - The cycle repeats yearly
 
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date, timedelta
 from decimal import Decimal
 from io import BytesIO
 import json
 import math
-from os.path import join as path_join
 import random
 from typing import Dict, List
 
@@ -24,8 +24,8 @@ from gacha_common.gen_gacha_banner_image import gen_gacha_banner_image
 from gacha_common.gen_gacha_description_text import \
     gen_gacha_description_text_combined
 from gacha_common.gen_gacha_per_table import gen_gacha_per_table
-from util import encrypt_replacements_json, read_json_decrypted, \
-                 replace_files_in_ver, replace_files_in_zip
+from util import VerTransaction, close_resource_indexes, encrypt_replacements_json, \
+                 read_json_parsed
 
 
 try:
@@ -300,6 +300,10 @@ def _gacha_list_entry(
                                                       first_gacha_id, resource_path, ver)
     banner_image = image_quantize(banner_image)
     # banner_image.save(f'gacha_banners/img_banner{first_gacha_id}.png')
+    # keep encoded PNG rather than Image, so entries are cheap to return from worker
+    # processes (and only encoded once)
+    io = BytesIO()
+    banner_image.save(io, format='PNG')
 
     desc_text = gen_gacha_description_text_combined(permanent_gacha_data,
                                                     limited_gacha_data_dict, GACHA_ODDS,
@@ -325,7 +329,7 @@ def _gacha_list_entry(
 
     return {
         'first_gacha_id': first_gacha_id,
-        'banner_image': banner_image,
+        'banner_png': io.getvalue(),
         'desc_text': desc_text,
         'per_table': per_table,
         'limited_data': limited_gacha_data_dict,
@@ -335,6 +339,35 @@ def _gacha_list_entry(
         'limited_contents_text_en': limited_contents_text_en
     }
 
+def _gacha_list_entries(
+        permanent_gacha_data: List[dict],
+        limited_gacha_data: List[dict],
+        first_gacha_id: int,
+        resource_path: str,
+        ver: int,
+        jobs: int=1
+    ) -> List[dict]:
+    """Generate list entries for permanent gacha (first), followed by each limited gacha,
+    with consecutive IDs starting at first_gacha_id.
+
+    If `jobs` is more than 1, entries are generated in parallel using that many processes.
+    Output is the same either way.
+    """
+    entry_args = [(None, first_gacha_id)]
+    for i, banner in enumerate(limited_gacha_data):
+        entry_args.append((banner, first_gacha_id + 1 + i))
+
+    if jobs <= 1:
+        return [_gacha_list_entry(permanent_gacha_data, banner, gacha_id, resource_path, ver)
+                for banner, gacha_id in entry_args]
+
+    # workers must not share open archives with this process
+    with ProcessPoolExecutor(jobs, initializer=close_resource_indexes) as pool:
+        futures = [pool.submit(_gacha_list_entry, permanent_gacha_data, banner, gacha_id,
+                               resource_path, ver)
+                   for banner, gacha_id in entry_args]
+        return [f.result() for f in futures]
+
 def _master_gacha_row(entry: dict, gacha_id: int, year: int) -> dict:
     limited_data = entry.get('limited_data')
     if limited_data:
@@ -569,15 +602,17 @@ def _gen_markdown_page_ja(
     return output
 
 
-def gen_gacha_rotation(resource_path, ver, start_year, end_year):
-    master_chara = read_json_decrypted(resource_path, ver, 'json/master_chara.json')
-    master_chara = json.loads(master_chara)
-    master_gacha_main = read_json_decrypted(resource_path, ver, 'json/master_gacha_main.json')
-    master_gacha_main = json.loads(master_gacha_main)
-    master_gacha_detail0 = read_json_decrypted(resource_path, ver, 'json/master_gacha_detail0.json')
-    master_gacha_detail0 = json.loads(master_gacha_detail0)
-    master_series = read_json_decrypted(resource_path, ver, 'json/master_series.json')
-    master_series = json.loads(master_series)
+def gen_gacha_rotation(resource_path, ver, start_year, end_year, jobs=1):
+    """Generate gacha rotation from start_year to end_year (inclusive), and add it to
+    given version.
+
+    If `jobs` is more than 1, banner images etc. are generated in parallel using that
+    many processes.
+    """
+    master_chara = read_json_parsed(resource_path, ver, 'json/master_chara.json')
+    master_gacha_main = read_json_parsed(resource_path, ver, 'json/master_gacha_main.json')
+    master_gacha_detail0 = read_json_parsed(resource_path, ver, 'json/master_gacha_detail0.json')
+    master_series = read_json_parsed(resource_path, ver, 'json/master_series.json')
 
     limited_gacha_data = load_and_parse_gacha_data_csv(LIMITED_CSV_PATH)
     permanent_gacha_data = load_and_parse_gacha_data_csv(PERMANENT_CSV_PATH)
@@ -597,21 +632,16 @@ def gen_gacha_rotation(resource_path, ver, start_year, end_year):
     gacha_id = math.ceil(gacha_id / 1000) * 1000
     first_gacha_id = gacha_id  # first occurence of each entry
 
-    permanent_gacha_entry = _gacha_list_entry(permanent_gacha_data, None, first_gacha_id,
-                                              resource_path, ver)
-    first_gacha_id += 1
+    entries = _gacha_list_entries(permanent_gacha_data, limited_gacha_data, first_gacha_id,
+                                  resource_path, ver, jobs)
+    permanent_gacha_entry = entries[0]
+    limited_gacha_unique_entires = entries[1:]
 
     # add TOP screen cards for permanent_gacha_entry manually
     for row in permanent_gacha_entry['per_table']:
         if row['ID'] in PERMANENT_TOP_SCREEN_CARDS:
             row['TOP'] = 1
 
-    limited_gacha_unique_entires = []
-    for banner in limited_gacha_data:
-        entry = _gacha_list_entry(permanent_gacha_data, banner, first_gacha_id,
-                                  resource_path, ver)
-        limited_gacha_unique_entires.append(entry)
-        first_gacha_id += 1
 
     # print(permanent_gacha_entry)
     # print(limited_gacha_unique_entires)
@@ -640,8 +670,11 @@ def gen_gacha_rotation(resource_path, ver, start_year, end_year):
 
     for entry in [permanent_gacha_entry] + limited_gacha_unique_entires:
         first_id = entry['first_gacha_id']
-        entry['banner_image'].save(f'gacha_md/static/gacha/img_banner{first_id}.png')
+        with open(f'gacha_md/static/gacha/img_banner{first_id}.png', 'wb') as f:
+            f.write(entry['banner_png'])
+
 
+    transaction = VerTransaction(resource_path, ver)
 
     # add gacha detail sheets to ver
     replacements = {}
@@ -651,32 +684,37 @@ def gen_gacha_rotation(resource_path, ver, start_year, end_year):
         first_id = entry["first_gacha_id"]
         replacements[f'json/master_gacha_detail{first_id}.json'] = json.dumps(full_table)
     replacements = encrypt_replacements_json(replacements)
-    zip_path = path_join(resource_path, str(ver), '1_json01.zip')
-    replace_files_in_zip(zip_path, replacements, if_exists=False)
+    transaction.add_files('1_json01.zip', replacements)
 
     # merge and replace master_gacha_main
     master_gacha_main.extend(master_gacha_rows)
     replacements = encrypt_replacements_json({
         'json/master_gacha_main.json': json.dumps(master_gacha_main)
     })
-    replace_files_in_ver(resource_path, ver, replacements)
+    transaction.replace_files(replacements)
 
     # add images to ver
     replacements = {}
     for entry in [permanent_gacha_entry] + limited_gacha_unique_entires:
-        io = BytesIO()
-        entry['banner_image'].save(io, format='PNG')
         first_id = entry["first_gacha_id"]
-        replacements[f'image/gacha/img_banner{first_id}.png'] = io.getvalue()
-    zip_path = path_join(resource_path, str(ver), '1_pkg.zip')
-    replace_files_in_zip(zip_path, replacements, if_exists=False)
+        replacements[f'image/gacha/img_banner{first_id}.png'] = entry['banner_png']
+    transaction.add_files('1_pkg.zip', replacements)
+
+    # write all changes
+    transaction.commit()
 
 if __name__ == '__main__':
     from sys import argv
 
-    if len(argv) != 5:
-        print('Usage: python gen_gacha_rotation.py <resource_path> <ver> <start_year> <end_year>')
-        print('Example: python gen_gacha_rotation.py res 733 2026 2031')
+    args = argv[1:]
+    jobs = 1
+    if len(args) == 6 and args[0] == '--jobs':
+        jobs = int(args[1])
+        args = args[2:]
+
+    if len(args) != 4:
+        print('Usage: python gen_gacha_rotation.py [--jobs <n>] <resource_path> <ver> <start_year> <end_year>')
+        print('Example: python gen_gacha_rotation.py --jobs 4 res 733 2026 2031')
         exit()
 
-    gen_gacha_rotation(argv[1], int(argv[2]), int(argv[3]), int(argv[4]))
+    gen_gacha_rotation(args[0], int(args[1]), int(args[2]), int(args[3]), jobs)
@@ -5,7 +5,6 @@ from datetime import date, timedelta
 from io import BytesIO
 import json
 import math
-from os.path import join as path_join
 from typing import Dict, List
 
 from PIL import Image
@@ -13,8 +12,7 @@ from PIL import Image
 from loginbonus_common.gen_loginbonus_image import IMAGE_SAFE_AREA_SIZE, \
                                                    IMAGE_SAFE_AREA_MARGINS, \
                                                    gen_loginbonus_image
-from util import encrypt_replacements_json, read_json_decrypted, \
-                 replace_files_in_ver, replace_files_in_zip
+from util import VerTransaction, encrypt_replacements_json, read_json_parsed
 
 
 try:
@@ -342,10 +340,8 @@ def _gen_markdown_page_ja(info_dicts: List[dict]) -> str:
 
 
 def gen_loginbonus_birthday(resource_path, ver, start_year, end_year):
-    master_login_event = read_json_decrypted(resource_path, ver, 'json/master_login_event.json')
-    master_login_event = json.loads(master_login_event)
-    master_login_event_detail_316 = read_json_decrypted(resource_path, ver, 'json/master_login_event_detail_316.json')
-    master_login_event_detail_316 = json.loads(master_login_event_detail_316)
+    master_login_event = read_json_parsed(resource_path, ver, 'json/master_login_event.json')
+    master_login_event_detail_316 = read_json_parsed(resource_path, ver, 'json/master_login_event_detail_316.json')
 
     login_event_id = max([row['ID'] for row in master_login_event[1:]]) + 1
     # go up to next multiple of 100, so it's neat
@@ -394,6 +390,8 @@ def gen_loginbonus_birthday(resource_path, ver, start_year, end_year):
         image.save(f'loginbonus_md/static/loginbonus/login_event{first_id}.png')
 
 
+    transaction = VerTransaction(resource_path, ver)
+
     # add event detail sheets
     replacements = {}
     for key, val in id_to_details.items():
@@ -401,8 +399,7 @@ def gen_loginbonus_birthday(resource_path, ver, start_year, end_year):
         full_table = [header_row] + val
         replacements[f'json/master_login_event_detail_{key}.json'] = json.dumps(full_table)
     replacements = encrypt_replacements_json(replacements)
-    zip_path = path_join(resource_path, str(ver), '1_json01.zip')
-    replace_files_in_zip(zip_path, replacements, if_exists=False)
+    transaction.add_files('1_json01.zip', replacements)
 
 
     # merge and replace master_login_event
@@ -410,7 +407,7 @@ def gen_loginbonus_birthday(resource_path, ver, start_year, end_year):
     replacements = encrypt_replacements_json({
         'json/master_login_event.json': json.dumps(master_login_event)
     })
-    replace_files_in_ver(resource_path, ver, replacements)
+    transaction.replace_files(replacements)
 
     # add images
     replacements = {}
@@ -419,8 +416,10 @@ def gen_loginbonus_birthday(resource_path, ver, start_year, end_year):
         info_dict['IMAGE'].save(io, format='PNG')
         first_id = info_dict['FIRST_ID']
         replacements[f'image/bg/login_event{first_id}.png'] = io.getvalue()
-    zip_path = path_join(resource_path, str(ver), '1_bg.zip')
-    replace_files_in_zip(zip_path, replacements, if_exists=False)
+    transaction.add_files('1_bg.zip', replacements)
+
+    # write all changes
+    transaction.commit()
 
 if __name__ == '__main__':
     from sys import argv
@@ -0,0 +1,152 @@
+# Image operations shared by the banner/bonus image generators.
+
+from collections import OrderedDict
+from functools import lru_cache
+from io import BytesIO
+import math
+
+from PIL import Image
+
+from util import get_resource_index
+
+
+# maximum total size (in bytes, uncompressed) of decoded images kept in memory by
+# load_bg_image and load_stand_image
+IMAGE_CACHE_BUDGET = 256 * 1024 * 1024
+
+# lookup table for alpha of stand images (steepens the falloff of their soft edges, and
+# removes the faint background rings)
+STAND_ALPHA_LUT = [min(max(round(a * 2.1 - 150), 0), 255) for a in range(256)]
+
+
+def filter_stand_bg_rings(image: Image.Image) -> Image.Image:
+    """Remove faint background rings from a stand (card) image, returning RGBA image.
+
+    Colour is unchanged, only alpha is remapped (using STAND_ALPHA_LUT).
+    """
+    # ensure RGBA
+    image = image.convert('RGBA')
+
+    # point applies a table per band, so colour bands get an identity table
+    return image.point(list(range(256)) * 3 + STAND_ALPHA_LUT)
+
+@lru_cache(maxsize=32)
+def _draw_split_bg_image_mask(size, split_pos, angle) -> Image.Image:
+    """Generate mask for split_bg_image_mask (cached, so must not be modified)."""
+    # compute constants
+    # (note: use pixel centres for calculation, so total distance is one less than height)
+    x_offset_per_y = math.tan(math.radians(angle))
+    x_offset_top = x_offset_per_y * (size[1] - 1) / 2
+    x_offset_top += split_pos * size[0]
+
+    # start with an empty background
+    mask_image = Image.new('RGBA', size)
+
+    for y in range(size[1]):
+        x_offset = x_offset_top - y * x_offset_per_y
+        if x_offset >= size[0]: continue  # no pixels to fill on this line
+        if x_offset < 0: x_offset = 0
+
+        # partially fill left-most pixel based on coverage
+        cov = 1 - (x_offset % 1)
+        mask_image.putpixel((int(x_offset), y), (0, 0, 0, int(255 * cov)))
+
+        # completely fill rest of row
+        fill_left = math.ceil(x_offset)
+        if fill_left < size[0]:
+            mask_image.paste((0, 0, 0, 255), (fill_left, y, size[0], y + 1))
+
+    return mask_image
+
+def split_bg_image_mask(size, split_pos, angle) -> Image.Image:
+    """Generates a mask for split background so only the right side is visible.
+
+    - size is (width, height)
+    - split_pos sets the position in pixels from the left edge
+    - angle sets the angle of the split in degrees from vertical (positive=slant to right)
+
+    Masks are cached, as the same ones are used for every image with the same number of
+    backgrounds.
+    """
+    return _draw_split_bg_image_mask(tuple(size), split_pos, angle).copy()
+
+# decoded (and cropped/resized) images, least recently used first
+# {(version path, filename, CRC, size, kind, target size): Image}
+_image_cache = OrderedDict()
+_image_cache_bytes = 0
+
+def _image_bytes(image: Image.Image) -> int:
+    """Return (approximate) memory used by image data."""
+    return image.width * image.height * len(image.getbands())
+
+def _load_resource_image(resource_path, ver, name, variant, process) -> Image.Image:
+    """Load image `name` from given version's resources, and pass it through
+    process (a function taking and returning an Image).
+
+    Results are cached (up to IMAGE_CACHE_BUDGET bytes), based on the CRC and size of the
+    file and variant (which must identify what process does).
+    Each call returns a new copy of the image, which is safe to modify.
+    """
+    global _image_cache_bytes
+
+    index = get_resource_index(resource_path, ver)
+    found = index.find(name)
+    if found is None:
+        raise FileNotFoundError(f'{name} not found in version {ver}')
+
+    zf, info = found
+    key = (index.ver_path, name, info.CRC, info.file_size) + variant
+    image = _image_cache.get(key)
+
+    if image is not None:
+        _image_cache.move_to_end(key)
+    else:
+        image = process(Image.open(BytesIO(zf.read(info))))
+        size = _image_bytes(image)
+        if size <= IMAGE_CACHE_BUDGET:
+            _image_cache[key] = image
+            _image_cache_bytes += size
+            while _image_cache_bytes > IMAGE_CACHE_BUDGET:
+                _, old_image = _image_cache.popitem(last=False)
+                _image_cache_bytes -= _image_bytes(old_image)
+
+    return image.copy()
+
+def load_bg_image(resource_path, ver, name, size) -> Image.Image:
+    """Load bg image `name` from given version's resources, cropped and resized to
+    size (width, height), as RGBA.
+    """
+    def process(image):
+        # convert to RGBA because input may be indexed colour
+        image = image.convert('RGBA')
+
+        w = size[0]
+        h = size[1]
+
+        # crop to correct aspect ratio (same as output)
+        crop_width = image.width
+        crop_height = int(image.width * (h / w))
+        if (crop_height > image.height):
+            crop_width = int(image.height * (w / h))
+            crop_height = image.height
+        crop_left = (image.width - crop_width) // 2
+        crop_upper = (image.height - crop_height) // 2
+        image = image.crop(
+            (crop_left, crop_upper, crop_left + crop_width, crop_upper + crop_height)
+        )
+        # resize
+        return image.resize((w, h))
+
+    return _load_resource_image(resource_path, ver, name, ('bg', tuple(size)), process)
+
+def load_stand_image(resource_path, ver, name, width) -> Image.Image:
+    """Load stand (card) image `name` from given version's resources, resized to width
+    (keeping aspect ratio) and filtered with filter_stand_bg_rings, as RGBA.
+    """
+    def process(image):
+        image = image.convert('RGBA')
+        height = image.height * width // image.width
+        image = image.resize((width, height))
+        return filter_stand_bg_rings(image)
+
+    return _load_resource_image(resource_path, ver, name, ('stand', width), process)
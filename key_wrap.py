@@ -0,0 +1,79 @@
+# Wrap AES keys into .c file content using the RSA private key.
+# Run directly to benchmark against the generic pycryptodome private key operation.
+
+from Crypto.Math.Numbers import Integer
+
+
+class KeyWrapper:
+    """Wraps AES keys with an RSA private key.
+
+    CRT parameters are precomputed once, and each wrap is a raw private key operation
+    without blinding (only the server's own AES keys are ever wrapped).
+    Results are checked using the public exponent, so a faulty result is never written.
+    """
+
+    def __init__(self, rsa_key):
+        if not rsa_key.has_private():
+            raise ValueError('RSA key is not a private key')
+
+        self.n = Integer(rsa_key.n)
+        self.e = Integer(rsa_key.e)
+        self.p = Integer(rsa_key.p)
+        self.q = Integer(rsa_key.q)
+        d = Integer(rsa_key.d)
+        self.dp = d % (self.p - 1)
+        self.dq = d % (self.q - 1)
+        self.q_inv = self.q.inverse(self.p)
+        self.size = rsa_key.size_in_bytes()
+
+    def wrap_aes_key(self, key_bytes):
+        """Encrypt AES key (hexadecimal bytes) to hexadecimal .c file content."""
+        padded = b'\x00\x01' + b'\xff'*(self.size - len(key_bytes) - 3) + b'\x00' + key_bytes
+        m = Integer.from_bytes(padded)
+
+        m1 = pow(m, self.dp, self.p)
+        m2 = pow(m, self.dq, self.q)
+        h = (self.q_inv * (m1 - m2)) % self.p
+        c = m2 + h * self.q
+
+        if pow(c, self.e, self.n) != m:
+            raise ValueError('RSA private key operation failed verification')
+
+        return c.to_bytes(self.size).hex().encode('ascii')
+
+    def wrap_aes_keys(self, keys):
+        """Encrypt list of AES keys (hexadecimal bytes), returning list of .c contents."""
+        return [self.wrap_aes_key(k) for k in keys]
+
+
+if __name__ == '__main__':
+    import codecs
+    from os import urandom
+    from time import perf_counter
+
+    from Crypto.Util.number import bytes_to_long
+
+    from crypto import privkey_cipher
+
+    count = 1000
+    keys = [codecs.encode(urandom(16), 'hex') for _ in range(count)]
+
+    def generic_wrap(key_bytes):
+        key_bytes = b'\x00\x01' + b'\xff'*(256-32-3) + b'\x00' + key_bytes
+        key_enc = privkey_cipher._decrypt_to_bytes(bytes_to_long(key_bytes))
+        return codecs.encode(key_enc, 'hex')
+
+    start = perf_counter()
+    expected = [generic_wrap(k) for k in keys]
+    generic_time = perf_counter() - start
+
+    wrapper = KeyWrapper(privkey_cipher)
+    start = perf_counter()
+    result = wrapper.wrap_aes_keys(keys)
+    wrapper_time = perf_counter() - start
+
+    assert result == expected, 'results differ'
+
+    print(f'pycryptodome: {generic_time / count * 1000:.3f}ms per key')
+    print(f'KeyWrapper:   {wrapper_time / count * 1000:.3f}ms per key')
+    print(f'Speedup:      {generic_time / wrapper_time:.2f}x')
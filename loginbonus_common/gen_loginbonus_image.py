@@ -6,6 +6,7 @@ from typing import List, Tuple
 import colorgram
 from PIL import Image, ImageDraw, ImageFont
 
+from image_util import load_bg_image, load_stand_image, split_bg_image_mask
 from util import read_file
 
 DEFAULT_BG = 'bg_live_1'
@@ -166,66 +167,6 @@ def _gen_itemquantity_text_image(quantity) -> Image.Image:
 
     return image
 
-def _load_bg_image(bg_io):
-    """Load, crop, and resize bg image to IMAGE_SIZE resolution RGBA.
-
-    Input is a file-like IO object.
-    """
-    image = Image.open(bg_io)
-    # convert to RGBA because input may be indexed colour
-    image = image.convert('RGBA')
-
-    w = IMAGE_SIZE[0]
-    h = IMAGE_SIZE[1]
-
-    # crop to correct aspect ratio (same as output)
-    crop_width = image.width
-    crop_height = int(image.width * (h / w))
-    if (crop_height > image.height):
-        crop_width = int(image.height * (w / h))
-        crop_height = image.height
-    crop_left = (image.width - crop_width) // 2
-    crop_upper = (image.height - crop_height) // 2
-    image = image.crop(
-        (crop_left, crop_upper, crop_left + crop_width, crop_upper + crop_height)
-    )
-    # resize
-    image = image.resize((w, h))
-
-    return image
-
-def _split_bg_image_mask(size, split_pos, angle):
-    """Generates a mask for split background so only the right side is visible.
-
-    - size is (width, height)
-    - split_pos sets the position in pixels from the left edge
-    - angle sets the angle of the split in degrees from vertical (positive=slant to right)
-    """
-    # compute constants
-    # (note: use pixel centres for calculation, so total distance is one less than height)
-    x_offset_per_y = math.tan(math.radians(angle))
-    x_offset_top = x_offset_per_y * (size[1] - 1) / 2
-    x_offset_top += split_pos * size[0]
-
-    # start with an empty background
-    mask_image = Image.new('RGBA', size)
-
-    pixels = mask_image.load()
-    for y in range(size[1]):
-        x_offset = x_offset_top - y * x_offset_per_y
-        if x_offset >= size[0]: continue  # no pixels to fill on this line
-        if x_offset < 0: x_offset = 0
-
-        # partially fill left-most pixel based on coverage
-        cov = 1 - (x_offset % 1)
-        pixels[int(x_offset), y] = (0, 0, 0, int(255 * cov))
-
-        # completely fill rest of row
-        for x in range(math.ceil(x_offset), size[0]):
-            pixels[x, y] = (0, 0, 0, 255)
-
-    return mask_image
-
 def _clamp_colour_lightness(colour: colorgram.Color, min: int, max: int) -> colorgram.Color:
     """Clamps lightness of colour to be within given range (inclusive)."""
     if colour.hsl.l < min:
@@ -266,23 +207,6 @@ def _clamp_colour_sat(colour: colorgram.Color, min: int, max: int) -> colorgram.
     proportion = colour.proportion
     return colorgram.Color(*rgb, proportion)
 
-def _filter_stand_bg_rings(image: Image.Image) -> Image.Image:
-    # ensure RGBA
-    image = image.convert('RGBA')
-
-    pixels = image.load()
-    for x in range(image.width):
-        for y in range(image.height):
-            colour = pixels[x, y]
-            alpha = colour[3]
-            alpha = round(alpha * 2.1 - 150)
-            alpha = max(alpha, 0)
-            alpha = min(alpha, 255)
-            colour = colour[0:3] + (alpha,)
-            pixels[x, y] = colour
-
-    return image
-
 def gen_loginbonus_image(
         bg_name: str,
         card_image_files: List[str],
@@ -301,14 +225,14 @@ def gen_loginbonus_image(
     # separate on slash character, used to denote multiple backgrounds
     bg_names = bg_name.split('/')
 
-    bg_bytes = read_file(resource_path, ver, f'image/bg/{bg_names[0]}.png')
-    bg_image = _load_bg_image(BytesIO(bg_bytes))
+    bg_image = load_bg_image(resource_path, ver, f'image/bg/{bg_names[0]}.png',
+                             IMAGE_SIZE)
     # if there's multiple backgrounds, paste them over, left-to-right
     for i, bg_name in enumerate(bg_names[1:]):
-        split_bytes = read_file(resource_path, ver, f'image/bg/{bg_name}.png')
-        split_image = _load_bg_image(BytesIO(split_bytes))
-        split_mask = _split_bg_image_mask((bg_image.width, bg_image.height),
-                                          i + 1 / len(bg_names), 20)
+        split_image = load_bg_image(resource_path, ver, f'image/bg/{bg_name}.png',
+                                    IMAGE_SIZE)
+        split_mask = split_bg_image_mask((bg_image.width, bg_image.height),
+                                         i + 1 / len(bg_names), 20)
         bg_image.paste(split_image, mask=split_mask)
 
     loginbonus_image.paste(
@@ -339,21 +263,16 @@ def gen_loginbonus_image(
     )
 
     # load and resize card images
-    card_image_bytes = [read_file(resource_path, ver, f) for f in card_image_files]
-    card_images = [Image.open(BytesIO(b)) for b in card_image_bytes]
-    for i, image in enumerate(card_images):
-        image = image.convert('RGBA')
+    card_images = []
+    for f in card_image_files:
         scale_width = cards_image.height
-        if len(card_images) <= 1:
+        if len(card_image_files) <= 1:
             scale_width = int(scale_width * 1.1)
-        elif len(card_images) <= 2:
+        elif len(card_image_files) <= 2:
             scale_width = int(scale_width * 1.0)
         else:
             scale_width = max(int(scale_width * 0.85), scale_width - IMAGE_SAFE_AREA_MARGINS[1] + 1)
-        scale_height = image.height * scale_width // image.width
-        image = image.resize((scale_width, scale_height))
-        image = _filter_stand_bg_rings(image)
-        card_images[i] = image
+        card_images.append(load_stand_image(resource_path, ver, f, scale_width))
 
     # hack to draw index 1 and/or 2 last
     if len(card_images) == 3:
@@ -1,10 +1,9 @@
 # makes an eternal (until 2038) exchange event (BIT fest), containing all event SR cards
 
 import json
-from os.path import join as path_join
 
-from util import encrypt_replacements_json, read_file, read_json_decrypted, \
-                 replace_files_in_ver, replace_files_in_zip
+from util import VerTransaction, encrypt_replacements_json, read_file, \
+                 read_json_parsed
 
 
 def make_eternal_exchange_event(resource_path, ver):
@@ -31,22 +30,22 @@ def make_eternal_exchange_event(resource_path, ver):
 
 
     # load and prepare data
-    events_json = json.loads(read_json_decrypted(
-        resource_path, ver, 'json/master_events.json'))
-    event_exchange_json = json.loads(read_json_decrypted(
-        resource_path, ver, 'json/master_event_exchange.json'))
-    reward_main_json = json.loads(read_json_decrypted(
-        resource_path, ver, 'json/master_exchange_event_reward_main.json'))
-    reward_personal_json = json.loads(read_json_decrypted(
-        resource_path, ver, 'json/master_exchange_event_reward_personal.json'))
-    rule_json = json.loads(read_json_decrypted(
-        resource_path, ver, 'json/master_rule.json'))
-    event_daily_json = json.loads(read_json_decrypted(
-        resource_path, ver, 'json/master_event_daily.json'))
-    top_banner_json = json.loads(read_json_decrypted(
-        resource_path, ver, 'json/master_top_banner.json'))
-    chara_json = json.loads(read_json_decrypted(
-        resource_path, ver, 'json/master_chara.json'))
+    events_json = read_json_parsed(
+        resource_path, ver, 'json/master_events.json')
+    event_exchange_json = read_json_parsed(
+        resource_path, ver, 'json/master_event_exchange.json')
+    reward_main_json = read_json_parsed(
+        resource_path, ver, 'json/master_exchange_event_reward_main.json')
+    reward_personal_json = read_json_parsed(
+        resource_path, ver, 'json/master_exchange_event_reward_personal.json')
+    rule_json = read_json_parsed(
+        resource_path, ver, 'json/master_rule.json')
+    event_daily_json = read_json_parsed(
+        resource_path, ver, 'json/master_event_daily.json')
+    top_banner_json = read_json_parsed(
+        resource_path, ver, 'json/master_top_banner.json')
+    chara_json = read_json_parsed(
+        resource_path, ver, 'json/master_chara.json')
 
     EVENT_ID = max(x['ID'] for x in events_json[1:]) + 1  # overall ID in master_events
     BIT_EVENT_ID = max(x['EVENT_ID'] for x in event_exchange_json[1:]) + 1  # ID within BIT event type
@@ -349,6 +348,8 @@ def make_eternal_exchange_event(resource_path, ver):
     event_daily_json.append(event_daily_entry)
     top_banner_json.append(top_banner_entry)
 
+    transaction = VerTransaction(resource_path, ver)
+
     # replace files in output
     replacements = encrypt_replacements_json({
         'json/master_events.json': json.dumps(events_json),
@@ -359,7 +360,7 @@ def make_eternal_exchange_event(resource_path, ver):
         'json/master_event_daily.json': json.dumps(event_daily_json),
         'json/master_top_banner.json': json.dumps(top_banner_json)
     })
-    replace_files_in_ver(resource_path, ver, replacements)
+    transaction.replace_files(replacements)
 
     # copy banner images
     # (copy from exchange event 55)
@@ -370,8 +371,10 @@ def make_eternal_exchange_event(resource_path, ver):
         f'image/event/exchange/{BIT_EVENT_ID}/btn_event_top.png': btn_event_top_bytes,
         f'image/home/img_topbanner_{TOP_BANNER_ID}.png': btn_event_top_bytes
     }
-    zip_path = path_join(resource_path, str(ver), '1_pkg.zip')
-    replace_files_in_zip(zip_path, replacements, if_exists=False)
+    transaction.add_files('1_pkg.zip', replacements)
+
+    # write all changes
+    transaction.commit()
 
 
 if __name__ == '__main__':
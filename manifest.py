@@ -0,0 +1,212 @@
+# Per-archive manifests of resource .zip files, stored in each version's directory.
+#
+# A manifest lists every directory and file (with size, CRC and sha256) in an archive,
+# so versions can be compared without reading every file again.
+# Size and CRC come straight from the archive's central directory, but sha256 requires
+# reading the file, so it's only calculated when needed (otherwise it's None).
+# Manifests record the size and modification time of their archive, and are ignored
+# (and regenerated when needed) if the archive no longer matches.
+
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+import json
+from os import makedirs, remove, replace, stat
+from os.path import basename, dirname, exists as path_exists, join as path_join
+from shutil import copy2
+from tempfile import mkstemp
+from zipfile import ZipFile
+
+from overlay import overlay_zip_path, version_layers
+
+
+# name of directory manifests are stored in (inside version directory)
+MANIFEST_DIR = 'manifest'
+
+# size of chunks files are read in when calculating hashes
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def manifest_path(zip_path) -> str:
+    """Return path of manifest file for given .zip archive."""
+    return path_join(dirname(zip_path), MANIFEST_DIR, basename(zip_path) + '.json')
+
+
+def file_entry(info, data) -> list:
+    """Return manifest entry for file with given ZipInfo and (uncompressed) data."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return [info.file_size, info.CRC, sha256(data).hexdigest()]
+
+
+def _hash_member(zf, name) -> str:
+    """Calculate sha256 hash of file in open ZipFile, reading it in chunks (so large
+    files don't need to be held in memory)."""
+    hash = sha256()
+    with zf.open(name) as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            hash.update(chunk)
+    return hash.hexdigest()
+
+
+def add_manifest_entry(manifest, info, data):
+    """Add file or directory with given ZipInfo and (uncompressed) data to manifest."""
+    if info.is_dir():
+        if info.filename not in manifest['dirs']:
+            manifest['dirs'].append(info.filename)
+    else:
+        manifest['files'][info.filename] = file_entry(info, data)
+
+
+def scan_archive(zip_path, hashes=False) -> dict:
+    """Generate manifest of .zip archive (without saving it).
+
+    If hashes is true, all files are read to calculate their sha256 hashes.
+    Otherwise, only the archive's central directory is read (which is much faster).
+    """
+    dirs = []
+    files = {}
+
+    with ZipFile(zip_path, 'r') as zf:
+        for f in zf.infolist():
+            if f.is_dir():
+                dirs.append(f.filename)
+            elif hashes:
+                files[f.filename] = [f.file_size, f.CRC, _hash_member(zf, f)]
+            else:
+                files[f.filename] = [f.file_size, f.CRC, None]
+
+    return {'dirs': dirs, 'files': files}
+
+
+def _add_missing_hashes(zip_path, manifest):
+    """Calculate sha256 hashes for files that don't have one yet in manifest."""
+    with ZipFile(zip_path, 'r') as zf:
+        for name, entry in manifest['files'].items():
+            if entry[2] is None:
+                entry[2] = _hash_member(zf, name)
+
+
+def _archive_stat(zip_path) -> (int, int):
+    """Return (size, modification time in ns) of archive."""
+    st = stat(zip_path)
+    return (st.st_size, st.st_mtime_ns)
+
+
+def read_archive_manifest(zip_path) -> dict | None:
+    """Read saved manifest of .zip archive.
+
+    Returns None if there's no manifest, or it doesn't match the current archive.
+    If the archive has been deleted, its manifest is returned as-is (manifests are kept
+    when full archives are deleted, so old versions can still be compared).
+    """
+    try:
+        with open(manifest_path(zip_path), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if not path_exists(zip_path):
+        return manifest
+    if (manifest.get('size'), manifest.get('mtime_ns')) != _archive_stat(zip_path):
+        return None
+    return manifest
+
+
+def write_archive_manifest(zip_path, manifest, archive_stat=None):
+    """Save manifest of .zip archive.
+
+    archive_stat should be the archive's (size, modification time in ns) from before it
+    was scanned. If not given, the current values are used, so this should be called
+    right after the archive is written.
+    """
+    path = manifest_path(zip_path)
+    makedirs(dirname(path), exist_ok=True)
+
+    size, mtime_ns = archive_stat or _archive_stat(zip_path)
+    manifest = {'size': size, 'mtime_ns': mtime_ns,
+                'dirs': manifest['dirs'], 'files': manifest['files']}
+
+    fd, tmp_path = mkstemp(suffix='.tmp', dir=dirname(path))
+    try:
+        with open(fd, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, separators=(',', ':'))
+        replace(tmp_path, path)
+    except BaseException:
+        remove(tmp_path)
+        raise
+
+
+def get_archive_manifest(zip_path, hashes=False) -> dict:
+    """Get manifest of .zip archive, scanning it (and saving the result) if the saved
+    manifest is missing or out of date.
+
+    If hashes is true, any missing sha256 hashes are also calculated.
+    """
+    manifest = read_archive_manifest(zip_path)
+    if manifest is None:
+        print(f'Scanning {zip_path}...')
+        archive_stat = _archive_stat(zip_path)
+        manifest = scan_archive(zip_path, hashes)
+        write_archive_manifest(zip_path, manifest, archive_stat)
+    elif hashes and any(entry[2] is None for entry in manifest['files'].values()):
+        print(f'Hashing {zip_path}...')
+        _add_missing_hashes(zip_path, manifest)
+        write_archive_manifest(zip_path, manifest, (manifest['size'], manifest['mtime_ns']))
+    return manifest
+
+
+def get_version_manifest(ver_path, zip_names, hashes=False) -> dict:
+    """Get manifests of archives in version directory, as {zip name: manifest}."""
+    return get_version_manifests([ver_path], zip_names, hashes)[0]
+
+
+def get_version_manifests(ver_paths, zip_names, hashes=False) -> list:
+    """Get manifests of archives in multiple version directories at once, as a list of
+    {zip name: manifest} (one for each version).
+
+    For overlay versions, manifests of all layers are combined.
+    Any archives that need scanning are scanned in parallel (decompression and hashing
+    don't hold the GIL, so threads are enough).
+    """
+    with ThreadPoolExecutor() as pool:
+        futures = []
+        for ver_path in ver_paths:
+            layers = version_layers(ver_path)
+            ver_futures = {}
+            for z in zip_names:
+                paths = [path_join(layers[0], z)]
+                paths += [p for p in (overlay_zip_path(l, z) for l in layers[1:])
+                          if path_exists(p)]
+                ver_futures[z] = [pool.submit(get_archive_manifest, p, hashes)
+                                  for p in paths]
+            futures.append(ver_futures)
+
+    return [{z: _merge_manifests([f.result() for f in layer_futures])
+             for z, layer_futures in ver_futures.items()}
+            for ver_futures in futures]
+
+
+def _merge_manifests(manifests) -> dict:
+    """Combine manifests of overlay layers (later ones take priority)."""
+    if len(manifests) == 1:
+        return manifests[0]
+
+    dirs = {}
+    files = {}
+    for manifest in manifests:
+        dirs.update(dict.fromkeys(manifest['dirs']))
+        files.update(manifest['files'])
+    return {'dirs': list(dirs), 'files': files}
+
+
+def copy_archive_manifest(zip_path_old, zip_path_new):
+    """Copy saved manifest to go with a copy of an archive, if it's still valid.
+
+    The new archive must have the same size and modification time as the old one.
+    """
+    if read_archive_manifest(zip_path_old) is None:
+        return
+
+    path_new = manifest_path(zip_path_new)
+    makedirs(dirname(path_new), exist_ok=True)
+    copy2(manifest_path(zip_path_old), path_new)
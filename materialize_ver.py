@@ -0,0 +1,70 @@
+# Turn an overlay version into a full version, by writing complete .zip archives
+# combining all of its layers.
+
+from os import remove, replace
+from os.path import abspath, basename, dirname, join as path_join
+from shutil import copymode, rmtree
+from tempfile import mkstemp
+from zipfile import ZipFile
+
+from manifest import get_version_manifest, write_archive_manifest
+from overlay import OVERLAY_DIR, OVERLAY_INFO_NAME, is_overlay
+from util import ALL_ZIP_NAMES, copy_zip_member, get_resource_index, \
+                 invalidate_resource_index
+
+
+def materialize_zip(index, zip_name, zip_path):
+    """Write complete archive `zip_name` for version of given ResourceIndex to zip_path.
+
+    Files are in their original order, followed by any files added by overlay
+    versions. File data is copied without being decompressed and recompressed.
+    The archive gets the same file mode as the full version's archive it's based on.
+    """
+    fd, tmp_path = mkstemp(suffix='.tmp', prefix=basename(zip_path) + '.',
+                           dir=dirname(abspath(zip_path)))
+    try:
+        with open(fd, 'wb') as out_file, ZipFile(out_file, 'w') as zip_out:
+            for _, zip_in, info in index.archive_files(zip_name).values():
+                copy_zip_member(zip_in, info, zip_out)
+        # temporary files are only readable by their owner, so use the base archive's mode
+        copymode(path_join(index.layer_paths()[-1], zip_name), tmp_path)
+        replace(tmp_path, zip_path)
+    except BaseException:
+        remove(tmp_path)
+        raise
+
+
+def materialize_ver(resource_path, ver):
+    """Write full .zip archives for overlay version, then remove its overlay data."""
+    ver_path = path_join(resource_path, str(ver))
+    if not is_overlay(ver_path):
+        print(f'Version {ver} is already a full version')
+        return
+
+    print(f'Materializing version {ver}...')
+    index = get_resource_index(resource_path, ver)
+    manifests = get_version_manifest(ver_path, ALL_ZIP_NAMES)
+
+    # full archives aren't used while the version is still marked as an overlay, so
+    # an interrupted run can safely be repeated
+    for zip_name in ALL_ZIP_NAMES:
+        zip_path = path_join(ver_path, zip_name)
+        materialize_zip(index, zip_name, zip_path)
+        write_archive_manifest(zip_path, manifests[zip_name])
+        print(f'  {zip_name} written')
+
+    invalidate_resource_index(path_join(ver_path, zip_name))
+    remove(path_join(ver_path, OVERLAY_INFO_NAME))
+    rmtree(path_join(ver_path, OVERLAY_DIR))
+    print('Done!')
+
+
+if __name__ == '__main__':
+    from sys import argv
+
+    if len(argv) != 3:
+        print('Usage: python materialize_ver.py <resource_path> <ver>')
+        print('Example: python materialize_ver.py res 735')
+        exit()
+
+    materialize_ver(argv[1], int(argv[2]))
@@ -1,43 +1,122 @@
 # Copy base (non-delta) .zip files from old version to new version dir,
 # and update version.json.
+# Files are reflinked or hard linked instead of copied when possible, so a new version
+# takes almost no time or space until its archives are changed.
 
-from os import makedirs
+from os import link, makedirs, remove
 from os.path import join as path_join
-from shutil import copy2
+from shutil import copy2, copystat
 
-from util import ALL_ZIP_NAMES, replace_files_in_zip
+from manifest import copy_archive_manifest, get_version_manifest
+from overlay import create_overlay, is_overlay
+from util import ALL_ZIP_NAMES, replace_files_in_ver
+
+
+# ioctl request to clone file contents (Linux, on filesystems such as btrfs and XFS)
+FICLONE = 0x40049409
+
+
+def reflink(src, dst):
+    """Create dst as a copy-on-write clone of src (with same modification time).
+
+    Raises OSError if not supported by the OS or filesystem.
+    """
+    try:
+        from fcntl import ioctl
+    except ImportError:
+        raise OSError('reflinks not supported on this OS')
+
+    with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+        try:
+            ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+        except OSError:
+            f_dst.close()
+            remove(dst)
+            raise
+    copystat(src, dst)
+
+
+def link_or_copy(src, dst) -> str:
+    """Copy file as cheaply as possible: a reflink, hard link, or normal copy.
+
+    Hard linked files share their data, so they must never be modified in place (the
+    functions in util.py replace archives instead of modifying them, except for
+    appending to files that aren't hard linked).
+
+    Returns method used ('reflink', 'link' or 'copy').
+    """
+    try:
+        reflink(src, dst)
+        return 'reflink'
+    except OSError:
+        pass
+
+    try:
+        link(src, dst)
+        return 'link'
+    except OSError:
+        pass
+
+    copy2(src, dst)
+    return 'copy'
 
 
 def copy_all_zips(ver_path_old, ver_path_new):
-    """Copies all base .zip files (ALL_ZIP_NAMES) from old dir to new dir"""
+    """Copies all base .zip files (ALL_ZIP_NAMES) from old dir to new dir,
+    along with their manifests (generated first if necessary).
+    """
+    get_version_manifest(ver_path_old, ALL_ZIP_NAMES)
+
+    methods = {}
     for z in ALL_ZIP_NAMES:
         z_old = path_join(ver_path_old, z)
         z_new = path_join(ver_path_new, z)
-        copy2(z_old, z_new)
+        method = link_or_copy(z_old, z_new)
+        methods[method] = methods.get(method, 0) + 1
+        copy_archive_manifest(z_old, z_new)
 
+    print('Archives copied:', ', '.join(f'{v} by {k}' for k, v in methods.items()))
 
-def update_version(ver_path, ver):
+
+def update_version(resource_path, ver):
     """Updates version.json in 1_pkg.zip to reflect the new version."""
-    zip_path = path_join(ver_path, '1_pkg.zip')
     replacements = {'version.json': f'[{{"version":{ ver }}}]'}
-    replace_files_in_zip(zip_path, replacements)
+    replace_files_in_ver(resource_path, ver, replacements, ['1_pkg.zip'])
+
 
+def new_ver(resource_path, ver_old, ver_new, overlay=False):
+    """Initialise new version with no changes.
 
-def new_ver(resource_path, ver_old, ver_new):
+    If overlay is true, the new version is an overlay version (only changed files are
+    stored, see overlay.py). Otherwise all base .zip files are copied.
+    """
     ver_path_old = path_join(resource_path, str(ver_old))
     ver_path_new = path_join(resource_path, str(ver_new))
 
-    makedirs(ver_path_new)
-    copy_all_zips(ver_path_old, ver_path_new)
-    update_version(ver_path_new, ver_new)
+    if overlay:
+        create_overlay(ver_path_new, ver_old)
+    else:
+        if is_overlay(ver_path_old):
+            raise ValueError(f'Version {ver_old} is an overlay version. '
+                             'Use materialize_ver.py first, or create an overlay version.')
+        makedirs(ver_path_new)
+        copy_all_zips(ver_path_old, ver_path_new)
+
+    update_version(resource_path, ver_new)
 
 
 if __name__ == '__main__':
     from sys import argv
 
-    if len(argv) != 4:
-        print('Usage: python new_ver.py <resource_path> <ver_old> <ver_new>')
+    args = argv[1:]
+    overlay = False
+    if len(args) == 4 and args[0] == '--overlay':
+        overlay = True
+        args = args[1:]
+
+    if len(args) != 3:
+        print('Usage: python new_ver.py [--overlay] <resource_path> <ver_old> <ver_new>')
         print('Example: python new_ver.py res 729 730')
         exit()
 
-    new_ver(argv[1], int(argv[2]), int(argv[3]))
+    new_ver(args[0], int(args[1]), int(args[2]), overlay)
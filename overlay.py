@@ -0,0 +1,63 @@
+# Overlay (layered) resource versions.
+#
+# An overlay version only stores the files it changes, on top of a parent version.
+# Its directory contains `overlay.json` (`{"parent": <ver>}`), and an `overlay` directory
+# holding a partial .zip archive for each archive it changes (containing only the
+# changed files). The parent can itself be an overlay version.
+# Use materialize_ver.py to turn an overlay version into a full version when needed.
+
+import json
+from os import makedirs
+from os.path import basename, dirname, exists as path_exists, join as path_join
+
+
+# name of file marking a version as an overlay version (inside version directory)
+OVERLAY_INFO_NAME = 'overlay.json'
+# name of directory partial archives are stored in (inside version directory)
+OVERLAY_DIR = 'overlay'
+
+
+def get_overlay_parent(ver_path) -> str | None:
+    """Return path of parent version if version is an overlay version, otherwise None."""
+    info_path = path_join(ver_path, OVERLAY_INFO_NAME)
+    if not path_exists(info_path):
+        return None
+
+    with open(info_path, 'r', encoding='utf-8') as f:
+        parent = json.load(f)['parent']
+    return path_join(dirname(ver_path), str(parent))
+
+
+def is_overlay(ver_path) -> bool:
+    """Return whether version is an overlay version."""
+    return path_exists(path_join(ver_path, OVERLAY_INFO_NAME))
+
+
+def create_overlay(ver_path, parent_ver):
+    """Set up (empty) version directory as an overlay on top of parent version."""
+    makedirs(path_join(ver_path, OVERLAY_DIR))
+    with open(path_join(ver_path, OVERLAY_INFO_NAME), 'w', encoding='utf-8') as f:
+        json.dump({'parent': parent_ver}, f)
+
+
+def overlay_zip_path(ver_path, zip_name) -> str:
+    """Return path of partial archive for overlay version (which may not exist)."""
+    return path_join(ver_path, OVERLAY_DIR, zip_name)
+
+
+def version_layers(ver_path) -> list:
+    """Return list of version paths making up a version, starting with the full version
+    at the bottom and ending with ver_path itself.
+    """
+    layers = [ver_path]
+    while (parent := get_overlay_parent(layers[0])) is not None:
+        layers.insert(0, parent)
+    return layers
+
+
+def version_path_for_zip(zip_path) -> str:
+    """Return path of version an archive belongs to (full or partial archive)."""
+    zip_dir = dirname(zip_path)
+    if basename(zip_dir) == OVERLAY_DIR:
+        return dirname(zip_dir)
+    return zip_dir
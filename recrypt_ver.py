@@ -1,25 +1,69 @@
 # Re-encrypt all encrypted JSON files in given resource version with new key.
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from os import listdir
-from os.path import join as path_join
+from os.path import basename, getsize, join as path_join
+from time import perf_counter
 
+from overlay import is_overlay
 from recrypt_zip import recrypt_zip
+from util import close_resource_indexes, invalidate_resource_index
 
 
-def recrypt_ver(resource_path, ver):
-    """Re-encrypt all .zip files for given version, overwriting them with new files."""
+def _recrypt_zip_timed(zip_path):
+    """Re-encrypt .zip file at given path, returning time taken in seconds."""
+    start = perf_counter()
+    recrypt_zip(zip_path)
+    return perf_counter() - start
+
+
+def recrypt_ver(resource_path, ver, jobs=1):
+    """Re-encrypt all .zip files for given version, overwriting them with new files.
+
+    If `jobs` is more than 1, archives are re-encrypted in parallel using that many
+    processes.
+    """
+    start = perf_counter()
+
     ver_path = path_join(resource_path, str(ver))
-    zip_paths = [path_join(ver_path, x) for x in listdir(ver_path)]
-    for z in zip_paths:
-        recrypt_zip(z)
+    if is_overlay(ver_path):
+        raise ValueError(f'Version {ver} is an overlay version. '
+                         'Use materialize_ver.py first.')
+
+    zip_paths = [path_join(ver_path, x) for x in listdir(ver_path) if x.endswith('.zip')]
+
+    if jobs <= 1:
+        for z in zip_paths:
+            print(f'{basename(z)}: {_recrypt_zip_timed(z):.1f}s')
+    else:
+        # start largest archives first so one isn't left running alone at the end
+        zip_paths.sort(key=getsize, reverse=True)
+
+        # workers must not share open archives with this process
+        with ProcessPoolExecutor(jobs, initializer=close_resource_indexes) as pool:
+            futures = {pool.submit(_recrypt_zip_timed, z): z for z in zip_paths}
+            for future in as_completed(futures):
+                print(f'{basename(futures[future])}: {future.result():.1f}s')
+
+        # archives were rewritten by workers, so any index here is out of date
+        for z in zip_paths:
+            invalidate_resource_index(z)
+
+    print(f'Version {ver} re-encrypted in {perf_counter() - start:.1f}s')
 
 
 if __name__ == '__main__':
     from sys import argv
 
-    if len(argv) != 3:
-        print('Usage: python recrypt_ver.py <resource_path> <ver>')
-        print('Example: python recrypt_ver.py res 730')
+    args = argv[1:]
+    jobs = 1
+    if len(args) == 4 and args[0] == '--jobs':
+        jobs = int(args[1])
+        args = args[2:]
+
+    if len(args) != 2:
+        print('Usage: python recrypt_ver.py [--jobs <n>] <resource_path> <ver>')
+        print('Example: python recrypt_ver.py --jobs 4 res 730')
         exit()
 
-    recrypt_ver(argv[1], int(argv[2]))
+    recrypt_ver(args[0], int(args[1]), jobs)
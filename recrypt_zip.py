@@ -1,91 +1,159 @@
 # Re-encrypt all encrypted JSON files in given .zip archive with new key.
 
-import codecs
-from io import BytesIO
-from os import listdir
-from os.path import join as path_join
-from zipfile import ZipFile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 from Crypto.PublicKey import RSA
-from Crypto.Util.number import bytes_to_long, long_to_bytes
 
-from crypto import decrypt_json_bytes_aeskey, encrypt_json_bytes_aeskey, \
-                   encrypt_new_aes_key, gen_new_aes_key, pubkey_bytes
+from crypto import decrypt_json_bytes_aeskey, encrypt_json_list, pubkey_bytes, \
+                   unwrap_aes_key
+from util import rewrite_zip
 
 
 with open('keys/server-public-key-orig.pem', 'rb') as f:
     rsa_key_old = RSA.importKey(f.read())
 
+# number of .json/.c pairs sent to a worker process at once
+RECRYPT_BATCH_SIZE = 64
+
 
 def decrypt_old_aes_key(c_bytes):
     """Given hexadecimal content of .c file, decrypt AES key.
 
     AES key is obtained using the old public key.
     """
-    c_long = bytes_to_long(codecs.decode(c_bytes, 'hex'))
-    return long_to_bytes(rsa_key_old._encrypt(c_long))[-32:]
+    return unwrap_aes_key(c_bytes, rsa_key_old)
+
+
+def recrypt_json(json_old, c_old):
+    """Re-encrypt a .json and .c file pair with new key, returning (json, c) bytes."""
+    return _recrypt_json_batch([(json_old, c_old)])[0]
+
 
+def _recrypt_json_batch(batch):
+    """Re-encrypt a list of (json, c) pairs, returning list of (json, c) pairs."""
+    json_dec_list = [decrypt_json_bytes_aeskey(json_old, decrypt_old_aes_key(c_old))
+                     for json_old, c_old in batch]
+    return encrypt_json_list(json_dec_list)
 
-def recrypt_zip(zip_path):
-    """Re-encrypt .zip file at given path, overwriting it with new file."""
-    out_buf = BytesIO()
-    zip_in = ZipFile(zip_path, 'r')
-    zip_out = ZipFile(out_buf, 'w')
+
+def _find_json_pairs(zip_in):
+    """Find encrypted .json/.c pairs in an open .zip file.
+
+    Returns list of (json_name, c_name), in order of the first file of each pair.
+    """
+    names = set(zip_in.NameToInfo)
+    pairs = []
+    seen = set()
 
     for f in zip_in.infolist():
-        if f.is_dir():
-            zip_out.mkdir(f)
-            continue
-        elif f.filename.endswith('server-public-key.pem'):
-            # replace with new key
-            zip_out.writestr(f, pubkey_bytes())
-            continue
+        if f.filename.endswith('.json'):
+            json_name = f.filename
+            c_name = f.filename[:-5] + '.c'
         elif f.filename.endswith('.c'):
-            # Ignore - process alongside .json
+            json_name = f.filename[:-2] + '.json'
+            c_name = f.filename
+        else:
             continue
-        elif not f.filename.endswith('.json'):
-            # Write directly to output
-            zip_out.writestr(f, zip_in.read(f))
+
+        if json_name in seen or json_name not in names or c_name not in names:
+            # already found, or no .json/.c pair (file isn't encrypted)
             continue
 
-        json_info = f
+        seen.add(json_name)
+        pairs.append((json_name, c_name))
 
-        try:
-            c_info = zip_in.getinfo(f.filename[:-5] + '.c')
-        except KeyError:
-            # Mo .c file: file isn't encrypted
-            # Write directly to output
-            zip_out.writestr(f, zip_in.read(f))
-            continue
+    return pairs
 
-        # print(f.filename)
 
-        c_old = zip_in.read(c_info)
-        key_old = decrypt_old_aes_key(c_old)
-        json_old = zip_in.read(json_info)
-        json_dec = decrypt_json_bytes_aeskey(json_old, key_old)
+def _iter_recrypted_pairs(zip_in, pairs, jobs):
+    """Yield re-encrypted (json, c) data for each pair, in order.
 
-        key_new = gen_new_aes_key(json_dec)
-        c_new = encrypt_new_aes_key(key_new)
-        json_new = encrypt_json_bytes_aeskey(json_dec, key_new)
+    If `jobs` is more than 1, pairs are read in batches and re-encrypted by that many
+    worker processes, with a limited number of batches waiting at once.
+    """
+    def read_pair(pair):
+        return (zip_in.read(pair[0]), zip_in.read(pair[1]))
 
-        zip_out.writestr(c_info, c_new)
-        zip_out.writestr(json_info, json_new)
+    if jobs <= 1:
+        for pair in pairs:
+            yield recrypt_json(*read_pair(pair))
+        return
 
-    zip_in.close()
-    zip_out.close()
+    with ProcessPoolExecutor(jobs) as pool:
+        waiting = deque()
+        for i in range(0, len(pairs), RECRYPT_BATCH_SIZE):
+            batch = [read_pair(p) for p in pairs[i:i + RECRYPT_BATCH_SIZE]]
+            waiting.append(pool.submit(_recrypt_json_batch, batch))
+
+            while len(waiting) >= jobs * 2:
+                yield from waiting.popleft().result()
+
+        while waiting:
+            yield from waiting.popleft().result()
+
+
+def recrypt_zip(zip_path, jobs=1):
+    """Re-encrypt .zip file at given path, overwriting it with new file.
+
+    If `jobs` is more than 1, JSON files are re-encrypted in parallel using that many
+    processes. Output is the same either way.
+    """
+    # pairs are found and read using the archive opened by rewrite_zip, as the original
+    # can't be replaced while another handle to it is open (on Windows)
+    pair_names = {}
+    recrypted = None
+
+    # re-encrypted data for the other file of a pair that has already been processed
+    pending = {}
+
+    def get_replacement(zip_in, f):
+        nonlocal recrypted
+
+        if recrypted is None:
+            pairs = _find_json_pairs(zip_in)
+            for json_name, c_name in pairs:
+                pair_names[json_name] = (json_name, c_name)
+                pair_names[c_name] = (json_name, c_name)
+            recrypted = _iter_recrypted_pairs(zip_in, pairs, jobs)
+
+        if f.filename.endswith('server-public-key.pem'):
+            # replace with new key
+            return pubkey_bytes()
+        elif f.filename in pending:
+            return pending.pop(f.filename)
+        elif f.filename not in pair_names:
+            # Keep original
+            return None
+
+        # pairs are re-encrypted in the order their first file appears
+        json_name, c_name = pair_names[f.filename]
+        json_new, c_new = next(recrypted)
+        pending[json_name] = json_new
+        pending[c_name] = c_new
+        return pending.pop(f.filename)
+
+    try:
+        rewrite_zip(zip_path, get_replacement)
+    finally:
+        if recrypted is not None:
+            recrypted.close()
 
-    with open(zip_path, 'wb') as f:
-        f.write(out_buf.getbuffer())
     print(f'{zip_path} re-encrypted with new key')
 
 
 if __name__ == '__main__':
     from sys import argv
 
-    if len(argv) != 2:
-        print('Usage: python recrypt_zip.py <path>.zip')
+    args = argv[1:]
+    jobs = 1
+    if len(args) == 3 and args[0] == '--jobs':
+        jobs = int(args[1])
+        args = args[2:]
+
+    if len(args) != 1:
+        print('Usage: python recrypt_zip.py [--jobs <n>] <path>.zip')
         print('Example: python recrypt_zip.py tutorial2.zip')
         exit()
 
-    recrypt_zip(argv[1])
+    recrypt_zip(args[0], jobs)
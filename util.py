@@ -1,9 +1,21 @@
-from io import BytesIO
-from os.path import join as path_join
-from zipfile import ZipFile
-
-from crypto import decrypt_json, encrypt_json_bytes_aeskey, encrypt_new_aes_key, \
-                   gen_new_aes_key
+from copy import copy
+import json
+from os import remove, replace, stat
+from os.path import abspath, basename, dirname, exists as path_exists, \
+                    join as path_join
+from shutil import copymode
+import pickle
+import struct
+from tempfile import mkstemp
+from zipfile import BadZipFile, ZipFile, ZIP64_LIMIT, sizeFileHeader, \
+                    stringFileHeader, structFileHeader, _FH_EXTRA_FIELD_LENGTH, \
+                    _FH_FILENAME_LENGTH, _FH_SIGNATURE, _MASK_USE_DATA_DESCRIPTOR, \
+                    _strip_extra
+
+from crypto import decrypt_json_stream, encrypt_json_list
+from disk_cache import read_cache_file, write_cache_file
+from manifest import add_manifest_entry, read_archive_manifest, write_archive_manifest
+from overlay import get_overlay_parent, overlay_zip_path, version_path_for_zip
 
 
 # name of all resource zip files, in order downloaded/extracted by the game on install
@@ -11,6 +23,143 @@ ALL_ZIP_NAMES = ['1_bg.zip', '1_card160.zip', '1_card640.zip', '1_effect.zip',
                  '1_icon.zip', '1_stand.zip', '1_movie.zip', '1_sound.zip', '1_ssbp.zip',
                  '1_json01.zip', '1_json02.zip', '1_json03.zip', '1_pkg.zip']
 
+# size of chunks used when copying compressed data between archives
+ZIP_COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class ResourceIndex:
+    """Open .zip archives for a single resource version, with a filename lookup.
+
+    Each archive is only opened (and its central directory parsed) once, the first
+    time it's needed. Use `get_resource_index` rather than creating these directly,
+    so indexes are shared and invalidated when archives are rewritten.
+
+    For overlay versions, files are looked up through all layers (files in this
+    version's partial archives take priority over the parent version's).
+    """
+
+    def __init__(self, ver_path):
+        self.ver_path = ver_path
+        parent_path = get_overlay_parent(ver_path)
+        self.parent = None if parent_path is None else _get_index_for_path(parent_path)
+        self.archives = {}
+        # zip name -> {filename: (zip name, ZipFile, ZipInfo)}, with overlays applied
+        self.archive_lookups = {}
+        # (zip names) -> {filename: (zip name, ZipFile, ZipInfo)}, later archives take
+        # priority
+        self.lookups = {}
+
+    def archive_path(self, zip_name) -> str:
+        """Return path of given archive in this version (partial archive for overlays)."""
+        if self.parent is not None:
+            return overlay_zip_path(self.ver_path, zip_name)
+        return path_join(self.ver_path, zip_name)
+
+    def layer_paths(self) -> list:
+        """Return paths of this version and all versions it's layered on."""
+        paths = [self.ver_path]
+        if self.parent is not None:
+            paths += self.parent.layer_paths()
+        return paths
+
+    def archive(self, zip_name) -> ZipFile | None:
+        """Return open ZipFile for given archive name (in this version only).
+
+        For overlay versions, returns None if this version doesn't change the archive.
+        """
+        if zip_name not in self.archives:
+            path = self.archive_path(zip_name)
+            if self.parent is not None and not path_exists(path):
+                self.archives[zip_name] = None
+            else:
+                self.archives[zip_name] = ZipFile(path, 'r')
+        return self.archives[zip_name]
+
+    def archive_files(self, zip_name) -> dict:
+        """Return dictionary of filename to (zip name, ZipFile, ZipInfo) for all files
+        in given archive (including parent versions, for overlay versions).
+        """
+        files = self.archive_lookups.get(zip_name)
+        if files is None:
+            files = {} if self.parent is None else dict(self.parent.archive_files(zip_name))
+            zf = self.archive(zip_name)
+            if zf is not None:
+                for info in zf.infolist():
+                    files[info.filename] = (zip_name, zf, info)
+            self.archive_lookups[zip_name] = files
+        return files
+
+    def lookup(self, zips=ALL_ZIP_NAMES) -> dict:
+        """Return dictionary of filename to (zip name, ZipFile, ZipInfo) for given
+        archives.
+
+        Later specified archives take priority.
+        """
+        key = tuple(zips)
+        files = self.lookups.get(key)
+        if files is None:
+            files = {}
+            for zip_name in zips:
+                files.update(self.archive_files(zip_name))
+            self.lookups[key] = files
+        return files
+
+    def find(self, name, zips=ALL_ZIP_NAMES):
+        """Find file `name`, returning (ZipFile, ZipInfo) or None if not found."""
+        found = self.lookup(zips).get(name)
+        if found is None:
+            return None
+        return found[1:]
+
+    def read(self, name, zips=ALL_ZIP_NAMES):
+        """Read file `name`, returning bytes or None if not found."""
+        found = self.find(name, zips)
+        if found is None:
+            return None
+        zf, info = found
+        return zf.read(info)
+
+    def close(self):
+        for zf in self.archives.values():
+            if zf is not None:
+                zf.close()
+        self.archives = {}
+        self.archive_lookups = {}
+        self.lookups = {}
+
+
+_resource_indexes = {}
+
+def _get_index_for_path(ver_path) -> ResourceIndex:
+    """Get (shared) ResourceIndex for given (absolute) version path."""
+    index = _resource_indexes.get(ver_path)
+    if index is None:
+        index = ResourceIndex(ver_path)
+        _resource_indexes[ver_path] = index
+    return index
+
+def get_resource_index(resource_path, ver) -> ResourceIndex:
+    """Get (shared) ResourceIndex for given version's resources."""
+    return _get_index_for_path(abspath(path_join(resource_path, str(ver))))
+
+def invalidate_resource_index(zip_path):
+    """Close and forget any ResourceIndex that may have the given archive open
+    (including overlay versions layered on its version).
+
+    Must be called before an archive is modified.
+    """
+    ver_path = version_path_for_zip(abspath(zip_path))
+    for path, index in list(_resource_indexes.items()):
+        if ver_path in index.layer_paths():
+            del _resource_indexes[path]
+            index.close()
+
+def close_resource_indexes():
+    """Close all open ResourceIndex archives."""
+    for index in _resource_indexes.values():
+        index.close()
+    _resource_indexes.clear()
+
 
 def read_file(resource_path, ver, name, zips=ALL_ZIP_NAMES):
     """Read file `name` from given version's resources.
@@ -21,15 +170,7 @@ def read_file(resource_path, ver, name, zips=ALL_ZIP_NAMES):
     Returns None if file not found in any archive.
     Returns bytes if file was found.
     """
-    ver_path = path_join(resource_path, str(ver))
-    zip_paths = [path_join(ver_path, x) for x in reversed(zips)]
-    for path in zip_paths:
-        z = ZipFile(path, 'r')
-        try:
-            return z.read(name)
-        except KeyError:
-            continue
-    return None
+    return get_resource_index(resource_path, ver).read(name, zips)
 
 
 def read_json_decrypted(resource_path, ver, name, zips=ALL_ZIP_NAMES):
@@ -44,15 +185,173 @@ def read_json_decrypted(resource_path, ver, name, zips=ALL_ZIP_NAMES):
     """
     assert name[-5:] == '.json'
 
-    json_bytes = read_file(resource_path, ver, name, zips)
-    if not json_bytes:
+    index = get_resource_index(resource_path, ver)
+
+    json_found = index.find(name, zips)
+    if not json_found or not json_found[1].file_size:
         return None
 
-    c_bytes = read_file(resource_path, ver, name[:-5] + '.c', zips)
+    c_bytes = index.read(name[:-5] + '.c', zips)
     if not c_bytes:
         return None
 
-    return decrypt_json(json_bytes, c_bytes)
+    # decrypt straight from the archive, so the encrypted data is never fully loaded
+    with json_found[0].open(json_found[1]) as json_stream:
+        return decrypt_json_stream(json_stream, c_bytes)
+
+
+# pickled data of parsed JSON files
+# {(version path, filename, .json CRC, .json size, .c CRC, .c size): pickled data}
+_parsed_json_cache = {}
+
+def read_json_parsed(resource_path, ver, name, zips=ALL_ZIP_NAMES):
+    """Read encrypted JSON file `name` from given version's resources,
+    decrypted and parsed.
+
+    `zips` can be used to limit what .zip archives are searched.
+    Later specified archives take priority.
+
+    Parsed data is cached in memory and on disk, based on the CRC and size of the
+    .json and .c files, so unchanged files are only decrypted and parsed once.
+    Each call returns a new copy of the data, which is safe to modify.
+
+    Returns None if file not found in any archive.
+    Returns parsed data (usually list of dict) if file was found.
+    """
+    assert name[-5:] == '.json'
+
+    index = get_resource_index(resource_path, ver)
+
+    json_found = index.find(name, zips)
+    if not json_found or not json_found[1].file_size:
+        return None
+
+    c_found = index.find(name[:-5] + '.c', zips)
+    if not c_found or not c_found[1].file_size:
+        return None
+
+    json_info = json_found[1]
+    c_info = c_found[1]
+    key = (index.ver_path, name,
+           json_info.CRC, json_info.file_size, c_info.CRC, c_info.file_size)
+    data = _parsed_json_cache.get(key)
+
+    if data is None:
+        cache_name = name[:-5].replace('/', '_')
+        cache_name += f'_{json_info.CRC:08x}_{json_info.file_size:x}'
+        cache_name += f'_{c_info.CRC:08x}_{c_info.file_size:x}.pickle'
+        data = read_cache_file('json', cache_name)
+
+        if data is None:
+            with json_found[0].open(json_info) as json_stream:
+                json_str = decrypt_json_stream(json_stream, c_found[0].read(c_info))
+            data = pickle.dumps(json.loads(json_str))
+            write_cache_file(data, 'json', cache_name)
+
+        _parsed_json_cache[key] = data
+
+    return pickle.loads(data)
+
+
+def copy_zip_member(zip_in, info, zip_out):
+    """Copy a member from one ZipFile to another without decompressing it.
+
+    The compressed data is copied as-is, keeping the local header, CRC, and
+    compression method of the original.
+    """
+    fp_in = zip_in.fp
+    fp_in.seek(info.header_offset)
+    header = fp_in.read(sizeFileHeader)
+    fields = struct.unpack(structFileHeader, header)
+    if fields[_FH_SIGNATURE] != stringFileHeader:
+        raise BadZipFile(f'Bad local file header for {info.filename}')
+    header += fp_in.read(fields[_FH_FILENAME_LENGTH] + fields[_FH_EXTRA_FIELD_LENGTH])
+
+    out_info = copy(info)
+    if info.flag_bits & _MASK_USE_DATA_DESCRIPTOR:
+        # CRC and sizes follow the data instead of being in the local header, so
+        # write a new header with them filled in (and don't copy the descriptor)
+        out_info.flag_bits &= ~_MASK_USE_DATA_DESCRIPTOR
+        out_info.extra = _strip_extra(out_info.extra, (1,))  # zip64 extra
+        zip64 = info.file_size > ZIP64_LIMIT or info.compress_size > ZIP64_LIMIT
+        header = out_info.FileHeader(zip64)
+
+    fp_out = zip_out.fp
+    fp_out.seek(zip_out.start_dir)
+    out_info.header_offset = fp_out.tell()
+    fp_out.write(header)
+
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = fp_in.read(min(remaining, ZIP_COPY_CHUNK_SIZE))
+        if not chunk:
+            raise BadZipFile(f'Unexpected end of data for {info.filename}')
+        fp_out.write(chunk)
+        remaining -= len(chunk)
+
+    zip_out.filelist.append(out_info)
+    zip_out.NameToInfo[out_info.filename] = out_info
+    zip_out.start_dir = fp_out.tell()
+    zip_out._didModify = True
+
+
+def rewrite_zip(zip_path, get_replacement, new_files={}):
+    """Rewrite existing .zip archive, replacing the contents of some files.
+
+    get_replacement is called as `get_replacement(zip_in, info)` for each file in the
+    archive, and should return the new data (str or bytes), or None to keep the
+    original. Original files are copied without being decompressed and recompressed.
+
+    new_files should be a dictionary of {filename: data} pairs, added after all
+    existing files.
+
+    Output will overwrite original input file (atomically, after it's complete).
+    If the archive has an up to date manifest, it's updated to match.
+    """
+    invalidate_resource_index(zip_path)
+
+    # only files that are actually replaced need to be hashed for the new manifest
+    manifest = read_archive_manifest(zip_path)
+    new_manifest = {'dirs': [], 'files': {}}
+
+    def add_to_manifest(zip_out, data):
+        if manifest is not None:
+            add_manifest_entry(new_manifest, zip_out.filelist[-1], data)
+
+    # write to a temporary file next to the original, then replace the original with
+    # it when complete (so the original can't be left half-written)
+    fd, tmp_path = mkstemp(suffix='.tmp', prefix=basename(zip_path) + '.',
+                           dir=dirname(abspath(zip_path)))
+    try:
+        with ZipFile(zip_path, 'r') as zip_in, open(fd, 'wb') as out_file, \
+             ZipFile(out_file, 'w') as zip_out:
+            for f in zip_in.infolist():
+                if f.is_dir():
+                    copy_zip_member(zip_in, f, zip_out)
+                    new_manifest['dirs'].append(f.filename)
+                    continue
+
+                data = get_replacement(zip_in, f)
+                if data is None:
+                    copy_zip_member(zip_in, f, zip_out)
+                    if manifest is not None:
+                        new_manifest['files'][f.filename] = manifest['files'][f.filename]
+                else:
+                    zip_out.writestr(f, data)
+                    add_to_manifest(zip_out, data)
+
+            for f, data in new_files.items():
+                zip_out.writestr(f, data)
+                add_to_manifest(zip_out, data)
+
+        copymode(zip_path, tmp_path)
+        replace(tmp_path, zip_path)
+    except BaseException:
+        remove(tmp_path)
+        raise
+
+    if manifest is not None:
+        write_archive_manifest(zip_path, new_manifest)
 
 
 def replace_files_in_zip(zip_path, replacements, if_exists=True):
@@ -63,52 +362,125 @@ def replace_files_in_zip(zip_path, replacements, if_exists=True):
 
     When if_exists is true, only pre-existing files in the archive are replaced
     (new files are not created).
+    When no pre-existing files are replaced, new files are appended in-place rather
+    than rewriting the whole archive (unless the archive is hard linked).
 
     Output will overwrite original input file.
     """
     zip_in = ZipFile(zip_path, 'r')
-    namelist_in = zip_in.namelist()
+    namelist_in = set(zip_in.namelist())
 
-    if if_exists:
-        has_any_replacements = False
-        for r in replacements.keys():
-            if r in namelist_in:
-                has_any_replacements = True
-                break
+    has_any_replacements = False
+    for r in replacements.keys():
+        if r in namelist_in:
+            has_any_replacements = True
+            break
 
-        if not has_any_replacements:
+    zip_in.close()
+
+    if not has_any_replacements:
+        if if_exists or not replacements:
             # skip processing - no matching files
             return
 
-    out_buf = BytesIO()
-    zip_out = ZipFile(out_buf, 'w')
+        if stat(zip_path).st_nlink == 1:
+            # only adding new files, so they can be appended without rewriting the
+            # existing contents
+            invalidate_resource_index(zip_path)
+            manifest = read_archive_manifest(zip_path)
+            zip_out = ZipFile(zip_path, 'a')
+            for f, data in replacements.items():
+                zip_out.writestr(f, data)
+                if manifest is not None:
+                    add_manifest_entry(manifest, zip_out.filelist[-1], data)
+            zip_out.close()
+            if manifest is not None:
+                write_archive_manifest(zip_path, manifest)
+            return
+
+        # archive shares its data with another version's copy (hard linked by new_ver),
+        # so it must be rewritten rather than modified in place
 
-    for f in zip_in.infolist():
-        if f.is_dir():
-            zip_out.mkdir(f)
-            continue
-        elif f.filename not in replacements:
-            # Write directly to output
-            zip_out.writestr(f, zip_in.read(f))
-            continue
-        else:
-            # Replace contents as file is confirmed to exist in original archive
-            zip_out.writestr(f, replacements[f.filename])
-
-    if not if_exists:
-        # Insert newly added files
-        new_files = [
-            (f, data) for f, data in replacements.items()
-            if f not in namelist_in
-        ]
-        for f, data in new_files:
-            zip_out.writestr(f, data)
+    if if_exists:
+        new_files = {}
+    else:
+        new_files = {f: data for f, data in replacements.items() if f not in namelist_in}
 
-    zip_in.close()
-    zip_out.close()
+    rewrite_zip(zip_path, lambda zip_in, f: replacements.get(f.filename), new_files)
+
+
+class VerTransaction:
+    """Collects file changes for a resource version, so they can be applied together.
 
-    with open(zip_path, 'wb') as f:
-        f.write(out_buf.getbuffer())
+    Changes are only written when commit() is called, and each affected .zip archive
+    is rewritten at most once. Archives that don't contain any of the files to
+    replace are skipped without being read (only their central directory is used).
+    For overlay versions, changed files are written to the version's partial archives.
+
+    When multiple changes are made to the same filename, the latest one is used.
+    """
+
+    def __init__(self, resource_path, ver):
+        self.resource_path = resource_path
+        self.ver = ver
+        # filename -> (data, zip names, if_exists)
+        self.files = {}
+
+    def replace_files(self, replacements, zips=ALL_ZIP_NAMES):
+        """Replace some files, in any archive they already exist in.
+
+        replacements should be a dictionary of {filename: data} pairs, e.g.:
+        `{'file.txt': 'contents'}` (data is str or bytes)
+
+        `zips` can be used to limit what .zip archives are modified.
+
+        Only pre-existing files in the archive are replaced (new files are not created).
+        """
+        for f, data in replacements.items():
+            self.files[f] = (data, tuple(zips), True)
+
+    def add_files(self, zip_name, replacements):
+        """Add (or replace) some files in a single archive.
+
+        replacements should be a dictionary of {filename: data} pairs, e.g.:
+        `{'file.txt': 'contents'}` (data is str or bytes)
+        """
+        for f, data in replacements.items():
+            self.files[f] = (data, (zip_name,), False)
+
+    def commit(self):
+        """Write all changes to the version's .zip archives."""
+        zip_names = []
+        for _, zips, _ in self.files.values():
+            zip_names += [z for z in zips if z not in zip_names]
+
+        # work out changes for every archive first, as rewriting an archive closes
+        # the index
+        index = get_resource_index(self.resource_path, self.ver)
+        zip_replacements = {}
+        for zip_name in zip_names:
+            names = index.archive_files(zip_name)
+            replacements = {
+                f: data for f, (data, zips, if_exists) in self.files.items()
+                if zip_name in zips and (not if_exists or f in names)
+            }
+            if replacements:
+                zip_replacements[zip_name] = replacements
+
+        # overlay versions write to their partial archives
+        zip_paths = {z: index.archive_path(z) for z in zip_replacements}
+        for zip_name, replacements in zip_replacements.items():
+            zip_path = zip_paths[zip_name]
+            if path_exists(zip_path):
+                replace_files_in_zip(zip_path, replacements, if_exists=False)
+            else:
+                # overlay version didn't change this archive yet
+                invalidate_resource_index(zip_path)
+                with ZipFile(zip_path, 'w') as zip_out:
+                    for f, data in replacements.items():
+                        zip_out.writestr(f, data)
+
+        self.files = {}
 
 
 def replace_files_in_ver(resource_path, ver, replacements, zips=ALL_ZIP_NAMES):
@@ -121,11 +493,11 @@ def replace_files_in_ver(resource_path, ver, replacements, zips=ALL_ZIP_NAMES):
     Output will overwrite original input file.
 
     Only pre-existing files in the archive are replaced (new files are not created).
+    Use VerTransaction instead when making multiple changes to a version.
     """
-    ver_path = path_join(resource_path, str(ver))
-    zip_paths = [path_join(ver_path, x) for x in zips]
-    for path in zip_paths:
-        replace_files_in_zip(path, replacements, if_exists=True)
+    transaction = VerTransaction(resource_path, ver)
+    transaction.replace_files(replacements, zips)
+    transaction.commit()
 
 
 def encrypt_replacements_json(replacements):
@@ -137,17 +509,20 @@ def encrypt_replacements_json(replacements):
 
     Final returned value contains new .json and .c file pairs, as well as unmodified
     data for any non-JSON files.
+    Content that has been encrypted before is taken from cache instead.
     """
+    json_list = []
+    for k, v in replacements.items():
+        if k.endswith('.json'):
+            json_list.append(v.encode('utf-8') if isinstance(v, str) else v)
+
+    encrypted = iter(encrypt_json_list(json_list))
+
     out = {}
     for k, v in replacements.items():
         if not k.endswith('.json'):
-            out[k] = content
+            out[k] = v
             continue
 
-        if isinstance(v, str):
-            v = v.encode('utf-8')
-
-        aeskey = gen_new_aes_key(v)
-        out[k] = encrypt_json_bytes_aeskey(v, aeskey)
-        out[k[:-5] + '.c'] = encrypt_new_aes_key(aeskey)
+        out[k], out[k[:-5] + '.c'] = next(encrypted)
     return out